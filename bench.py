@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+"""
+End-to-end benchmark on synthetic Plex DBs.
+
+Generates fake libraries (`plexlib.synthetic`), runs every stage of the pipeline on them
+and writes the timings as JSON, optionally comparing against an earlier run. Fails if the
+CLI takes longer than `--startup-budget` to start or imports a heavy backend to do so,
+which `--startup-only` checks on its own, in a few seconds and without generating anything.
+"""
+
+# stdlib
+import os
+import sys
+import json
+import time
+import sqlite3
+import pathlib
+import platform
+import tempfile
+import contextlib
+import subprocess
+import datetime as dt
+
+# 3rd party
+import click
+
+MAIN = pathlib.Path(__file__).absolute().with_name("main.py")
+# what no command should pay for before it needs it
+HEAVY_MODULES = ("polars", "pony", "numpy", "snowflake", "thefuzz", "rapidfuzz")
+# most seconds `main.py --help` may take, interpreter startup included
+STARTUP_BUDGET = 0.3
+
+
+@contextlib.contextmanager
+def timed(timings, stage):
+    start = time.perf_counter()
+    yield
+    timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+@click.command()
+@click.option("--servers", default=3, show_default=True, help="Number of fake Plex DBs")
+@click.option("--shows", default=200, show_default=True, help="Shows in the shared catalog")
+@click.option("--films", default=1_000, show_default=True, help="Films in the shared catalog")
+@click.option("--views", default=50_000, show_default=True, help="Views per server")
+@click.option("--accounts", default=20, show_default=True, help="Accounts per server")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--workdir", type=click.Path(file_okay=False), help="Where to build, defaults to a temp dir")
+@click.option("--out", type=click.Path(dir_okay=False), default="bench.json", show_default=True)
+@click.option(
+    "--baseline", type=click.Path(exists=True, dir_okay=False), help="Earlier --out to compare against"
+)
+@click.option(
+    "--startup-budget",
+    default=STARTUP_BUDGET,
+    show_default=True,
+    help="Most seconds `main.py --help` may take to start",
+)
+@click.option(
+    "--startup-only",
+    is_flag=True,
+    help="Only check the CLI's startup time and imports, without building anything",
+)
+def main(servers, shows, films, views, accounts, seed, workdir, out, baseline, startup_budget, startup_only):
+    if startup_only:
+        startup = startup_seconds("--help")
+        print(f"{'startup':<20}{startup:>10.3f}")
+        sys.exit(check_startup(startup, heavy_imports(), startup_budget))
+
+    out = pathlib.Path(out).absolute()
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        workdir = pathlib.Path(workdir).absolute()
+        workdir.mkdir(parents=True, exist_ok=True)
+        # plexlib resolves combined.db and output/ against the working directory
+        os.chdir(workdir)
+
+        from plexlib.synthetic import write_plex_dbs
+
+        timings = {"startup": startup_seconds("--help")}
+        heavy = heavy_imports()
+        with timed(timings, "generate"):
+            write_plex_dbs(
+                workdir, servers=servers, shows=shows, films=films, views=views, accounts=accounts, seed=seed
+            )
+
+        result = {
+            "timestamp": dt.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "params": {
+                "servers": servers,
+                "shows": shows,
+                "films": films,
+                "views": views,
+                "accounts": accounts,
+                "seed": seed,
+            },
+            "timings": timings,
+            "rows": run_stages(timings),
+        }
+
+    out.write_text(json.dumps(result, indent=2))
+    report(result, json.loads(pathlib.Path(baseline).read_text()) if baseline else None)
+    sys.exit(check_startup(timings["startup"], heavy, startup_budget))
+
+
+def check_startup(startup, heavy, budget) -> int:
+    """Print how the CLI's `startup` seconds and `heavy` imports fail the gate, returns the exit status."""
+    if heavy:
+        print(f"FAIL: importing main.py imports {', '.join(heavy)}")
+    if startup > budget:
+        print(f"FAIL: main.py --help took {startup:.3f}s, over the {budget}s budget")
+    return 1 if heavy or startup > budget else 0
+
+
+def startup_seconds(*args, repeat=5):
+    """Best wall time of `repeat` runs of `main.py *args`, interpreter startup included."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(MAIN), *args], check=True, capture_output=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def heavy_imports():
+    """The `HEAVY_MODULES` that importing main.py imports."""
+    code = f"import sys, main; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=MAIN.parent, check=True, capture_output=True, text=True
+    )
+    return result.stdout.split()
+
+
+def run_stages(timings):
+    from plexlib import DB
+    from plexlib.data import (
+        combine_accounts,
+        combine_media,
+        extract_accounts,
+        extract_media,
+        extract_streams,
+        source_dbs,
+    )
+    from plexlib.load import BulkLoader
+    from plexlib.local import load_local_dataset
+    from plexlib.rollup import sync_rollup
+    from plexlib.schema import db
+    from plexlib.stats import run_questions
+
+    if DB.exists():
+        os.remove(DB)
+    db.bind(provider="sqlite", filename=str(DB.absolute()), create_db=True)
+    db.generate_mapping(create_tables=True)
+
+    with BulkLoader(DB) as loader:
+        for source_db in source_dbs():
+            with timed(timings, "extract_accounts"):
+                extract_accounts(source_db, loader)
+            with timed(timings, "extract_media"):
+                extract_media(source_db, loader)
+            with timed(timings, "extract_streams"):
+                extract_streams(source_db, loader)
+
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            with timed(timings, "combine_accounts"):
+                combine_accounts()
+            with timed(timings, "combine_media"):
+                combine_media()
+
+    with timed(timings, "base_frame"):
+        df = load_local_dataset().collect()
+    with timed(timings, "rollup"):
+        cube = sync_rollup(df).collect()
+    with timed(timings, "group_stats"):
+        run_questions(cube, scope="group")
+    with timed(timings, "individual_stats"):
+        run_questions(cube, scope="user")
+
+    conn = sqlite3.connect(DB)
+    counts = dict(
+        conn.execute(
+            """
+            SELECT 'accounts', count(*) FROM "Account"
+            UNION ALL SELECT 'super_accounts', count(*) FROM "SuperAccount"
+            UNION ALL SELECT 'media', count(*) FROM "Media"
+            UNION ALL SELECT 'super_media', count(*) FROM "SuperMedia"
+            UNION ALL SELECT 'streams', count(*) FROM "Stream"
+            """
+        )
+    )
+    conn.close()
+    return {**counts, "base_frame": df.height, "rollup": cube.height}
+
+
+def report(result, baseline=None):
+    print(f"{'stage':<20}{'seconds':>10}" + (f"{'baseline':>10}{'ratio':>8}" if baseline else ""))
+    for stage, seconds in result["timings"].items():
+        line = f"{stage:<20}{seconds:>10.3f}"
+        if baseline and stage in baseline["timings"]:
+            before = baseline["timings"][stage]
+            line += f"{before:>10.3f}{seconds / before if before else float('nan'):>8.2f}"
+        print(line)
+    print(", ".join(f"{k}={v}" for k, v in result["rows"].items()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
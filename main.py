@@ -14,26 +14,16 @@ Start answering questions from gdoc
 
 # stdlib
 import sys
-import os
-import sqlite3
-import functools
-import datetime as dt
+import json
 
 # 3rd party
-from pony import orm
 import click
-import polars as pl
-import numpy as np
-import snowflake
-import snowflake.connector
 
-# local
-from plexlib import ROOT, DB, OUTPUT, with_cache
-from plexlib.data import build_database, fetch_data_from_db
-from plexlib.schema import Account, Media, Stream
+# polars, pony and snowflake are imported by the commands that use them, so `--help` (or
+# `cache`) doesn't wait on all of them
 
 
-@click.command()
+@click.group()
 def main():
     """
     PLEX WRAPPED!!
@@ -41,29 +31,74 @@ def main():
     Ended up importing all data to Snowflake so this will just primarily focus on
     ingestion, caching, and then answering all the questions!
     """
-    # build_database(rebuild)
-    pl.Config.set_tbl_rows(500)
-    pl.Config.set_tbl_cols(50)
-
-    df = load_dataset(
-        """
-        SELECT *
-        FROM plex_wrapped.output.plex_wrapped_2023_base
-    """
-    )
-    print(sorted(df.columns))
-
-    print(sorted(df.get_column("user").unique()))
 
-    # print(df.filter((pl.col("user") == "zo347") & (pl.col("media_type") != "TV Series")))
-    # return
-    # owner_stats()
-    # individual_stats(df, user="zo347")
-    group_stats(df)
-    individual_stats(df)
 
-
-def group_stats(df: pl.DataFrame):
+@main.command()
+@click.option("--full", is_flag=True, help="Start combined.db over instead of appending")
+@click.option("--jobs", default=1, show_default=True, help="Worker processes for extraction, one per source DB")
+@click.option("--stages", is_flag=True, help="Print time, memory and counts per build stage")
+@click.option(
+    "--link",
+    type=(click.Choice(["account", "media"]), str, str),
+    multiple=True,
+    metavar="KIND SOURCEDB:ID SOURCEDB:ID",
+    help="Always combine these two accounts or media, applied by builds with --full",
+)
+@click.option(
+    "--unlink",
+    type=(click.Choice(["account", "media"]), str, str),
+    multiple=True,
+    metavar="KIND SOURCEDB:ID SOURCEDB:ID",
+    help="Never combine these two accounts or media, applied by builds with --full",
+)
+def build(full, jobs, stages, link, unlink):
+    """Extract new or changed Plex DBs into combined.db."""
+    from plexlib.data import build_database
+    from plexlib.decisions import add_override
+    from plexlib.instrument import summary
+
+    for outcome, overrides in (("match", link), ("no_match", unlink)):
+        for kind, a, b in overrides:
+            add_override(kind, _source_key(a), _source_key(b), outcome)
+    records = build_database(True, jobs=jobs, full=full)
+    if stages:
+        print(summary(records))
+
+
+@main.command()
+@click.option("--interval", default=60, show_default=True, help="Seconds between polls")
+@click.option("--jobs", default=1, show_default=True, help="Worker processes for extraction, one per source DB")
+def watch(interval, jobs):
+    """Keep polling the Plex DBs while Plex runs, updating output/live.json."""
+    from plexlib.watch import watch
+
+    watch(interval=interval, jobs=jobs)
+
+
+@main.group()
+@click.option(
+    "--backend",
+    type=click.Choice(["snowflake", "local"]),
+    default="snowflake",
+    show_default=True,
+    help="Where the base dataset comes from, local reads combined.db",
+)
+@click.option("--by-user", is_flag=True, help="Partition the stream store by user as well as by month")
+@click.option("--memory", is_flag=True, help="Print the in memory size of every column of the base dataset")
+@click.pass_context
+def stats(ctx, backend, by_user, memory):
+    """Answer the questions, off a rollup of every view."""
+    ctx.obj = {"backend": backend, "by_user": by_user, "memory": memory}
+
+
+@stats.command("group")
+@click.option("-q", "--question", "names", multiple=True, help="Only this question, can be repeated")
+@click.option("--profile", is_flag=True, help="Profile each question instead of printing its answer")
+@click.option(
+    "--approximate", is_flag=True, help="Only print the top show, movie and star leaderboards, from per source sketches"
+)
+@click.pass_obj
+def stats_group(obj, names, profile, approximate):
     """
     Most popular show
     Most popular movie
@@ -73,245 +108,248 @@ def group_stats(df: pl.DataFrame):
     Who watched the most during work hours on weekdays (6a - 5p)
     Percent of users who watch with subtitles
     """
-    print("Top show")
-    X = (
-        df.filter((pl.col("viewed_at") >= dt.date(2023, 1, 1)) & (pl.col("media_type") == "TV Series"))
-        .group_by("grandparent_title")
-        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
-        .sort("duration_hours")
-        .filter((pl.col("duration_hours").rank(descending=True)) <= 5)
-    )
-    print(X)
-
-    print("Top movie")
-    X = (
-        df.filter((pl.col("viewed_at") >= dt.date(2023, 1, 1)) & (pl.col("media_type") != "TV Series"))
-        .group_by("title")
-        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
-        .sort("duration_hours")
-        .filter((pl.col("duration_hours").rank(descending=True)) <= 5)
-    )
-    print(X)
-
-    print("Top genre")
-    X = stats_by_tag(df, "tags_genre").filter((pl.col("duration_hours").rank(descending=True)) <= 5)
-    print(X)
-
-    print("Top star")
-    X = stats_by_tag(df, "tags_star").filter((pl.col("duration_hours").rank(descending=True)) <= 5)
-    print(X)
-
-    print("Top director")
-    X = stats_by_tag(df, "tags_director").filter((pl.col("duration_hours").rank(descending=True)) <= 5)
-    print(X)
-
-    print("Top country")
-    X = stats_by_tag(df, "tags_country").filter((pl.col("duration_hours").rank(descending=True)) <= 5)
-    print(X)
-
-    print("Watched most past 1am MST")
-    X = (
-        df.filter(pl.col("viewed_at") >= dt.date(2023, 1, 1))
-        .with_columns(sleepy_time=pl.col("viewed_at").dt.hour().is_between(1, 6, closed="both"))
-        .filter("sleepy_time")
-        .group_by("user")
-        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
-        .sort("duration_hours")
-        .filter((pl.col("duration_hours").rank(descending=True)) <= 5)
-    )
-    print(X)
-
-    print("Watched most during work hours on weekdays")
-    X = (
-        df.filter(pl.col("viewed_at") >= dt.date(2023, 1, 1))
-        .with_columns(
-            during_work_hours=(
-                pl.col("viewed_at").dt.hour().is_between(8, 17, closed="both")
-                & pl.col("viewed_at").dt.weekday().is_between(1, 5, closed="both")
-            )
+    _polars()
+    if approximate:
+        from plexlib.sketch import leaderboards
+        from plexlib.stats import START
+
+        for name, X in leaderboards(year=START.year).items():
+            print(f"{name} (approximate)")
+            print(X)
+        return
+
+    names = _question_names("group", names)
+    df = load_views(**obj)
+    tables = load_tables("group", names)
+    if profile:
+        profile_stats(df, scope="group", names=names, tables=tables)
+        return
+    group_stats(df, names=names, tables=tables)
+
+
+@stats.command("user")
+@click.argument("user", required=False)
+@click.option("-q", "--question", "names", multiple=True, help="Only this question, can be repeated")
+@click.option("--profile", is_flag=True, help="Profile each question instead of printing its answer")
+@click.option(
+    "--quantiles",
+    type=click.Choice(["exact", "sketch"]),
+    default="exact",
+    show_default=True,
+    help="How the Garbagemeter's rating quantiles are computed",
+)
+@click.pass_obj
+def stats_user(obj, user, names, profile, quantiles):
+    """Per user questions, for USER or else everyone."""
+    _polars()
+    names = _question_names("user", names)
+    df = load_views(**obj, user=user)
+    tables = load_tables("user", names)
+    if profile:
+        profile_stats(df, scope="user", names=names, user=user, tables=tables)
+        return
+    individual_stats(df, user=user, quantiles=quantiles, names=names, tables=tables)
+
+
+@stats.command("reports")
+@click.option("--jobs", default=1, show_default=True, help="Worker processes rendering the reports")
+@click.option("--force", is_flag=True, help="Write every user's report again, changed or not")
+@click.pass_obj
+def stats_reports(obj, jobs, force):
+    """Write a JSON and HTML report of the user questions for every user, to output/reports."""
+    from plexlib.reports import REPORTS, write_reports
+
+    df = load_views(**obj)
+    written = write_reports(df, tables=load_tables("user"), jobs=jobs, force=force)
+    print(f"Wrote {len(written)} reports to {REPORTS}")
+
+
+@stats.command("questions")
+def stats_questions():
+    """List every question, by scope."""
+    from plexlib.stats import questions
+
+    for scope in ("group", "user", "owner"):
+        print(f"{scope}:")
+        for q in questions(scope=scope):
+            print(f"  {q.name}")
+
+
+@main.command()
+def owner():
+    """Media added last year, from snowflake."""
+    _polars()
+    owner_stats()
+
+
+@main.command()
+@click.option("--clear", is_flag=True, help="Remove every entry")
+def cache(clear):
+    """List the cached datasets, least recently used first."""
+    from plexlib.cache import cache_entries, clear_cache
+
+    if clear:
+        clear_cache()
+        return
+    for meta in cache_entries():
+        print(
+            f"{meta['key']}  {meta['source']:<12} {meta['function']:<24}"
+            f" {meta['rows']:>10} rows {meta['bytes']:>14} bytes"
         )
-        .filter("during_work_hours")
-        .group_by("user")
-        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
-        .sort("duration_hours")
-        .filter((pl.col("duration_hours").rank(descending=True)) <= 5)
-        .with_columns(workdays_wasted=pl.col("duration_hours") / 8)
-    )
-    print(X)
 
 
-def individual_stats(df: pl.DataFrame, user=None):
-    if user is not None:
-        df = df.filter(pl.col("user") == user)
-
-    top_n = 3
-
-    print("Total watch time")
-    X = (
-        df.filter(pl.col("viewed_at") >= dt.date(2023, 1, 1))
-        .group_by("user")
-        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
-        .with_columns(duration_days=pl.col("duration_hours") / 24)
-        .sort("duration_hours")
-    )
-    print(X)
-
-    print("Top show by user")
-    X = (
-        df.filter((pl.col("viewed_at") >= dt.date(2023, 1, 1)) & (pl.col("media_type") == "TV Series"))
-        .group_by("user", "grandparent_title")
-        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
-        .sort("user", "duration_hours")
-        .filter((pl.col("duration_hours").rank(descending=True).over("user")) <= top_n)
-    )
-    print(X)
-
-    print("Top movie by user")
-    X = (
-        df.filter((pl.col("viewed_at") >= dt.date(2023, 1, 1)) & (pl.col("media_type") != "TV Series"))
-        .group_by("user", "title")
-        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
-        .sort("user", "duration_hours")
-        .filter((pl.col("duration_hours").rank(descending=True).over("user")) <= top_n)
-    )
-    print(X)
-
-    print("Top genre by user")
-    X = stats_by_tag(df, "tags_genre", by=["user"]).filter(
-        (pl.col("duration_hours").rank(descending=True).over("user")) <= top_n
-    )
-    print(X)
-
-    print("Top star by user")
-    X = stats_by_tag(df, "tags_star", by=["user"]).filter(
-        (pl.col("duration_hours").rank(descending=True).over("user")) <= top_n
-    )
-    print(X)
-
-    print("Top director by user")
-    X = stats_by_tag(df, "tags_director", by=["user"]).filter(
-        (pl.col("duration_hours").rank(descending=True).over("user")) <= top_n
-    )
-    print(X)
-
-    print("Top country by user")
-    X = stats_by_tag(df, "tags_country", by=["user"]).filter(
-        (pl.col("duration_hours").rank(descending=True).over("user")) <= top_n
-    )
-    print(X)
-
-    print("Garbagemeter")
-    X = (
-        df.filter((pl.col("viewed_at") >= dt.date(2023, 1, 1)))
-        .filter(pl.col("media_type") != "TV Series")
-        .with_columns(
-            (
-                pl.when(pl.col("grandparent_title").is_null() | (pl.col("grandparent_title") == ""))
-                .then(pl.col("title"))
-                .otherwise(pl.concat_str(["title", "grandparent_title"], separator=" - "))
-                .alias("name")
-            ),
-        )
-        .group_by("user")
-        .agg(
-            pl.col("rating").quantile(i / 10, interpolation="nearest").alias(f"Rating Quantile @ {i/10:0.0%}")
-            for i in range(0, 11, 1)
-        )
-        .sort("Rating Quantile @ 0%")
-    )
-    print(X)
-
-
-def stats_by_tag(df: pl.DataFrame, column: str, by: list[str] = None) -> pl.DataFrame:
-    if by is None:
-        by = []
-    newcol = column.split("_")[-1]
-    X = (
-        df.filter(
-            (pl.col("viewed_at") >= dt.date(2023, 1, 1))
-            & (pl.col(column).is_not_null())
-            & (pl.col("media_type") != "TV Series")
+def load_views(backend, by_user=False, memory=False, user=None):
+    """
+    The base dataset from `backend` as a rollup of its views (see `plexlib.rollup`), kept
+    up to date from the stream store. For a single `user`, their views of the stats' year
+    instead, scanning only the partitions they can be in (see `--by-user`).
+    """
+    import polars as pl
+    from plexlib import DB
+    from plexlib.compact import memory_report
+    from plexlib.rollup import VIEW_COLUMNS as ROLLUP_COLUMNS, sync_rollup
+    from plexlib.stats import END, START
+    from plexlib.store import scan_store, sync_store
+
+    if backend == "local":
+        from plexlib.local import SOURCE, load_local_dataset
+
+        df = load_local_dataset()
+        stat = DB.stat()
+        stamp = f"combined.db:{stat.st_size}:{stat.st_mtime_ns}"
+        source = SOURCE
+    else:
+        from plexlib.cache import entry_meta
+        from plexlib.warehouse import BASE_QUERY, load_dataset
+
+        df = load_dataset(BASE_QUERY)
+        # a refetch (e.g. after `cache --clear`) is a new entry, which the store and rollup
+        # can't be appended from
+        entry = entry_meta(load_dataset.cache_key(BASE_QUERY))
+        stamp = source = f"snowflake:{entry['key']}:{entry['created']}"
+    # the session questions' columns are checked by `load_tables`, if any is asked
+    missing = sorted(set(ROLLUP_COLUMNS) - set(df.columns))
+    if missing:
+        raise click.ClickException(
+            f"The {backend} base dataset has no {', '.join(missing)}, which the stats need"
         )
-        .with_columns(pl.col(column).str.split("|").alias(newcol))
-        .explode(newcol)
-        .group_by(*by, newcol)
-        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
-        .sort(*by, "duration_hours")
-    )
-    return X
+    if memory:
+        print(memory_report(df))
+    sync_store(df, stamp, by_user=by_user)
+    if user is not None:
+        df = scan_store(since=START, until=END, user=user)
+    else:
+        df = sync_rollup(scan_store(), source=source)
+    print(sorted(df.columns))
+
+    print(sorted(df.select(pl.col("user").unique()).collect().get_column("user")))
+    return df
+
+
+def load_tables(scope, names=None):
+    """
+    The session tables (see `plexlib.sessions`) of the stream store, if any question of
+    `scope` selected needs them. Call after `load_views`, which brings the store up to date.
+    """
+    from plexlib.stats import questions
+
+    needed = {table for q in questions(scope=scope, names=names) for table in q.tables}
+    if not needed & {"sessions", "binges"}:
+        return {}
+    from plexlib.sessions import VIEW_COLUMNS, sync_sessions
+    from plexlib.stats import END, START
+    from plexlib.store import scan_store, store_meta
+
+    meta = store_meta()
+    missing = sorted({*VIEW_COLUMNS, "duration_minutes"} - set(meta["schema"]))
+    if missing:
+        raise click.ClickException(f"The base dataset has no {', '.join(missing)}, which sessions need")
+    stamp = f"{meta['stamp']}:since={START}:until={END}"
+    tables = sync_sessions(scan_store(since=START, until=END), stamp)
+    return {name: tables[name] for name in ("sessions", "binges")}
+
+
+def group_stats(df, names=None, tables=None):
+    from plexlib.stats import run_questions
+
+    for name, X in run_questions(df, scope="group", names=names, tables=tables).items():
+        print(name)
+        print(X)
+
+
+def individual_stats(df, user=None, quantiles="exact", names=None, tables=None):
+    from plexlib.stats import garbagemeter_sketch, questions, run_questions
+
+    names = names or [q.name for q in questions(scope="user")]
+    sketched = quantiles == "sketch" and "Garbagemeter" in names
+    if sketched:
+        names = [name for name in names if name != "Garbagemeter"]
+    results = run_questions(df, scope="user", names=names, user=user, tables=tables)
+    if sketched:
+        results["Garbagemeter"] = garbagemeter_sketch(df, user=user)
+    for name, X in results.items():
+        print(name)
+        print(X)
 
 
 def owner_stats():
+    from plexlib import OUTPUT
+    from plexlib.stats import run_questions
+    from plexlib.warehouse import load_dataset
+
     # load all media added from last year
     last_year_media_query = "SELECT * FROM media WHERE strftime('%Y', added_date) = '2023'"
-    df = load_dataset(last_year_media_query)
-
-    # Media Added
-    X = (
-        df.with_columns(
-            [
-                (
-                    pl.when(pl.col("parent_title").is_null() | (pl.col("parent_title") == ""))
-                    .then(pl.col("title"))
-                    .otherwise(pl.col("parent_title"))
-                    .alias("name")
-                ),
-            ]
-        )
-        .group_by(["sourcedb", "media_type"])
-        .agg(
-            pl.col("name").count().alias("# Added"),
-            pl.col("duration_minutes").sum(),
-            pl.col("rating").drop_nans().drop_nulls().mean(),
-            pl.col("audience_rating").drop_nans().drop_nulls().mean(),
-        )
-        .with_columns((pl.col("duration_minutes") / 60).alias("hours"))
-        .sort("sourcedb", "media_type")
-    )
-    print(X)
-
-    # media added by genre
-    X = (
-        df.with_columns(
-            [
-                (
-                    pl.when(pl.col("parent_title").is_null() | (pl.col("parent_title") == ""))
-                    .then(pl.col("title"))
-                    .otherwise(pl.col("parent_title"))
-                    .alias("name")
-                ),
-                (pl.col("tags_genre").replace("", "UNK").str.split("|").alias("genres")),
-            ]
-        )
-        .with_columns((pl.col("genres").list.first().alias("genre")))
-        .group_by(["sourcedb", "media_type", "genre"])
-        .agg(
-            pl.col("name").count().alias("# Added"),
-            pl.col("duration_minutes").sum(),
-            pl.col("rating").drop_nans().drop_nulls().mean(),
-            pl.col("audience_rating").drop_nans().drop_nulls().mean(),
-        )
-        .with_columns((pl.col("duration_minutes") / 60).alias("hours"))
-        .sort("sourcedb", "media_type", "audience_rating")
-    )
-    print(X)
-    X.write_csv(OUTPUT / "added_by_genre.csv")
+    df = load_dataset(last_year_media_query).collect()
 
+    results = run_questions(df, scope="owner")
+    for name, X in results.items():
+        print(name)
+        print(X)
+    OUTPUT.mkdir(parents=True, exist_ok=True)
+    results["Media added by genre"].write_csv(OUTPUT / "added_by_genre.csv")
 
-@with_cache
-def load_dataset(query):
-    account = os.environ["SNOWFLAKE_ACCOUNT"]
-    user = os.environ["SNOWFLAKE_USER"]
-    passwd = os.environ["SNOWFLAKE_PASSWORD"]
 
-    conn = snowflake.connector.connect(account=account, user=user, password=passwd)
+def profile_stats(df, scope, names=None, user=None, tables=None):
+    """Profile the questions of `scope`, print them slowest first and save the plans and node timings."""
+    import polars as pl
+    from plexlib import OUTPUT
+    from plexlib.stats import profile_questions
 
-    df = pl.read_database(
-        query=query,
-        connection=conn,
-    )
+    reports = profile_questions(df, scope=scope, names=names, user=user, tables=tables)
+    OUTPUT.mkdir(parents=True, exist_ok=True)
+    (OUTPUT / "question_profile.json").write_text(json.dumps(reports, indent=2))
+    columns = ("question", "scope", "seconds", "rows", "bytes", "slowest_node")
+    print(pl.DataFrame([{k: report.get(k) for k in columns} for report in reports]).sort("seconds", descending=True))
 
-    return df
+
+def _polars():
+    import polars as pl
+
+    pl.Config.set_tbl_rows(500)
+    pl.Config.set_tbl_cols(50)
+
+
+def _question_names(scope, names):
+    """`names` checked against the questions of `scope`, None (every question) if empty."""
+    if not names:
+        return None
+    from plexlib.stats import questions
+
+    known = [q.name for q in questions(scope=scope)]
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise click.BadParameter(
+            f"no {scope} question {', '.join(map(repr, unknown))}, see `stats questions`", param_hint="--question"
+        )
+    return list(names)
+
+
+def _source_key(value):
+    """`server0:12` -> `("server0", 12)`, an account or media by the Plex DB and id it came from."""
+    sourcedb, _, originalid = value.rpartition(":")
+    if not sourcedb or not originalid.isdigit():
+        raise click.BadParameter(f"expected SOURCEDB:ID, got {value!r}")
+    return sourcedb, int(originalid)
 
 
 if __name__ == "__main__":
@@ -1,30 +1,16 @@
 # stdlib
-import os
 import pathlib
-import functools
-
-# 3rd party
-import polars as pl
 
 ROOT = pathlib.Path()
 DB = ROOT / "combined.db"
+# created by whatever writes to it first, importing plexlib has no side effects
 OUTPUT = ROOT / "output"
 
-if not OUTPUT.exists():
-    os.mkdir(OUTPUT)
-
-
-def with_cache(func):
-    @functools.wraps(func)
-    def _(*args, **kwargs):
-        cachefile = OUTPUT / f"cache_{func.__name__}.feather"
-        if not cachefile.exists():
-            df: pl.DataFrame = func(*args, **kwargs)
-            df.columns = [c.lower() for c in df.columns]
-            df.write_ipc(cachefile)
-        else:
-            df = pl.read_ipc(cachefile)
 
-        return df
+def __getattr__(name):
+    # `plexlib.with_cache` without importing polars along with the package
+    if name == "with_cache":
+        from .cache import with_cache
 
-    return _
+        return with_cache
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,162 @@
+# stdlib
+import json
+import time
+import hashlib
+import inspect
+import functools
+
+# 3rd party
+import polars as pl
+
+# local
+from . import OUTPUT
+from .files import atomic_write
+
+CACHE_MAX_BYTES = 4 * 1024**3
+FORMATS = {"ipc": "feather", "parquet": "parquet"}
+
+
+def with_cache(
+    func=None, *, ttl=None, source=None, max_bytes=CACHE_MAX_BYTES, lazy=False, format="ipc", normalize=None
+):
+    """
+    Cache a function returning a polars DataFrame as files under `OUTPUT`.
+
+    Entries are keyed on the function (name and source) and its arguments, expire after
+    `ttl` seconds if given, and the least recently used ones are evicted once the cache
+    grows past `max_bytes`. Usable bare (`@with_cache`) or with options
+    (`@with_cache(ttl=3600, source="snowflake")`).
+
+    With `lazy`, the cached entry comes back as a LazyFrame scanning the file (memory-mapped
+    for uncompressed IPC, row-group statistics for `format="parquet"`), so only the columns
+    and rows a query touches are ever read.
+
+    `normalize(df) -> df` (e.g. `plexlib.compact.compact`) is applied to fresh results
+    before they are written, so every read gets its dtypes.
+    """
+    if func is None:
+        return functools.partial(
+            with_cache, ttl=ttl, source=source, max_bytes=max_bytes, lazy=lazy, format=format, normalize=normalize
+        )
+
+    extra = (format,) if normalize is None else (format, normalize.__module__, normalize.__qualname__)
+
+    @functools.wraps(func)
+    def _(*args, **kwargs):
+        key = cache_key(func, args, kwargs, *extra)
+        df = read_entry(key, ttl=ttl, lazy=lazy)
+        if df is None:
+            df: pl.DataFrame = func(*args, **kwargs)
+            df.columns = [c.lower() for c in df.columns]
+            if normalize is not None:
+                df = normalize(df)
+            write_entry(key, df, format=format, function=func.__qualname__, source=source or func.__module__)
+            evict(max_bytes)
+            if lazy:
+                scanned = read_entry(key, lazy=True)
+                df = df.lazy() if scanned is None else scanned
+
+        return df
+
+    # which entry a call reads or writes, e.g. to tell a refetch from the entry it replaced
+    _.cache_key = lambda *args, **kwargs: cache_key(func, args, kwargs, *extra)
+    return _
+
+
+def cache_key(func, args, kwargs, *extra) -> str:
+    try:
+        code = inspect.getsource(func)
+    except (OSError, TypeError):
+        code = ""
+    payload = repr((func.__module__, func.__qualname__, code, args, sorted(kwargs.items()), extra))
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def read_entry(key, ttl=None, lazy=False):
+    """The cached frame for `key`, or None if it is missing or older than `ttl` seconds."""
+    metafile = OUTPUT / f"cache_{key}.json"
+    try:
+        meta = json.loads(metafile.read_text())
+        if ttl is not None and time.time() - meta["created"] > ttl:
+            return None
+        df = _read(OUTPUT / meta["file"], meta["format"], lazy)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    meta["accessed"] = time.time()
+    atomic_write(metafile, lambda f: f.write(json.dumps(meta).encode()))
+    return df
+
+
+def entry_meta(key):
+    """The metadata of the entry for `key`, or None. Unlike `read_entry` it doesn't count as a use."""
+    try:
+        return json.loads((OUTPUT / f"cache_{key}.json").read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _read(datafile, format, lazy):
+    if not datafile.exists():
+        raise FileNotFoundError(datafile)
+    if format == "parquet":
+        return pl.scan_parquet(datafile) if lazy else pl.read_parquet(datafile)
+    return pl.scan_ipc(datafile, memory_map=True) if lazy else pl.read_ipc(datafile)
+
+
+def write_entry(key, df: pl.DataFrame, format="ipc", **meta):
+    OUTPUT.mkdir(parents=True, exist_ok=True)
+    datafile = OUTPUT / f"cache_{key}.{FORMATS[format]}"
+    metafile = OUTPUT / f"cache_{key}.json"
+    if format == "parquet":
+        atomic_write(datafile, lambda f: df.write_parquet(f, statistics=True, row_group_size=256_000))
+    else:
+        # uncompressed so that lazy reads can memory-map it
+        atomic_write(datafile, lambda f: df.write_ipc(f, compression="uncompressed"))
+    now = time.time()
+    meta = {
+        "key": key,
+        **meta,
+        "format": format,
+        "file": datafile.name,
+        "created": now,
+        "accessed": now,
+        "rows": df.height,
+        "bytes": datafile.stat().st_size,
+    }
+    # metadata goes last, an entry only counts once it has some
+    atomic_write(metafile, lambda f: f.write(json.dumps(meta).encode()))
+
+
+def cache_entries() -> list[dict]:
+    """Metadata of every cache entry, least recently used first."""
+    entries = []
+    for metafile in OUTPUT.glob("cache_*.json"):
+        try:
+            entries.append(json.loads(metafile.read_text()))
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+    return sorted(entries, key=lambda meta: meta["accessed"])
+
+
+def evict(max_bytes=CACHE_MAX_BYTES):
+    """Drop least recently used entries until the cache fits in `max_bytes`."""
+    entries = cache_entries()
+    total = sum(meta["bytes"] for meta in entries)
+    for meta in entries:
+        if total <= max_bytes:
+            break
+        remove_entry(meta["key"])
+        total -= meta["bytes"]
+
+
+def remove_entry(key):
+    # metadata first, so a half-removed entry is already a miss
+    (OUTPUT / f"cache_{key}.json").unlink(missing_ok=True)
+    for extension in FORMATS.values():
+        (OUTPUT / f"cache_{key}.{extension}").unlink(missing_ok=True)
+
+
+def clear_cache():
+    for meta in cache_entries():
+        remove_entry(meta["key"])
@@ -0,0 +1,63 @@
+# 3rd party
+import polars as pl
+
+# low cardinality strings repeated on every view of the same media, user or device
+CATEGORICAL_COLUMNS = [
+    "sourcedb",
+    "user",
+    "device_name",
+    "device_platform",
+    "media_type",
+    "title",
+    "grandparent_title",
+    "studio",
+    "content_rating",
+    "tags_genre",
+    "tags_director",
+    "tags_writer",
+    "tags_star",
+    "tags_country",
+]
+# ids join and append across loads, so they get the same width whatever a load's range is
+ID_COLUMNS = {"stream_id": pl.Int64, "media_id": pl.Int32}
+INTEGER_COLUMNS = ["duration_minutes", "year"]
+FLOAT_COLUMNS = ["rating", "audience_rating"]
+
+# sorts like the strings did, files don't keep the ordering so readers cast back to it
+LEXICAL = pl.Categorical(ordering="lexical")
+
+
+def compact(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    The base frame in its compact dtypes: repeated strings as (lexically sorted)
+    `Categorical`, ids as `ID_COLUMNS`, durations and years in the narrowest integer type
+    their values fit and ratings as `Float32`. Columns it doesn't have are skipped.
+    """
+    return df.with_columns(
+        *(pl.col(c).cast(pl.Utf8).cast(LEXICAL) for c in CATEGORICAL_COLUMNS if c in df.columns),
+        *(pl.col(c).cast(dtype) for c, dtype in ID_COLUMNS.items() if c in df.columns),
+        *(pl.col(c).shrink_dtype() for c in INTEGER_COLUMNS if c in df.columns and df.schema[c].is_integer()),
+        *(pl.col(c).cast(pl.Float32) for c in FLOAT_COLUMNS if c in df.columns),
+    )
+
+
+def memory_report(df: pl.DataFrame) -> pl.DataFrame:
+    """In memory size of every column of `df`, next to what it takes as plain strings and 64 bit numbers."""
+    df = df.lazy().collect()
+    wide = df.with_columns(
+        pl.col(pl.Categorical).cast(pl.Utf8),
+        pl.col(pl.INTEGER_DTYPES).cast(pl.Int64),
+        pl.col(pl.FLOAT_DTYPES).cast(pl.Float64),
+    )
+    return (
+        pl.DataFrame(
+            {
+                "column": df.columns,
+                "dtype": [str(dtype) for dtype in df.dtypes],
+                "bytes": [s.estimated_size() for s in df],
+                "wide_bytes": [s.estimated_size() for s in wide],
+            }
+        )
+        .with_columns(saved=1 - pl.col("bytes") / pl.col("wide_bytes"))
+        .sort("wide_bytes", descending=True)
+    )
@@ -2,62 +2,262 @@
 import os
 import pathlib
 import sqlite3
+import tempfile
+import warnings
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 # 3rd party
+import polars as pl
 from pony import orm
-from thefuzz import fuzz
 from tqdm import tqdm
 
 # local
-from plexlib.schema import db, Media, Account, Stream, SuperAccount, SuperMedia
+from plexlib.dedup import DisjointSet, cluster_names, fuzzy_pairs, match_media, ratio
+from plexlib.decisions import DECISIONS, DecisionStore
+from plexlib.instrument import STAGES, count, stage, trace, write_log
+from plexlib.load import BulkLoader
+from plexlib.schema import db, Media, Account, Source, Stream, SuperAccount, SuperMedia
+from plexlib.sketch import SpaceSaving, add_sketches, clear_sketches
 from . import ROOT, DB
 
+FETCH_SIZE = 10_000
 
-def build_database(rebuild):
-    if not rebuild:
-        db.bind(provider="sqlite", filename=str(DB.absolute()), create_db=True)
-        db.generate_mapping(create_tables=True)
-        return
+WATERMARKS = ("max_view_id", "max_media_item_id", "max_account_id")
+EMPTY_FINGERPRINT = {"size": 0, "mtime": 0.0, **{k: 0 for k in WATERMARKS}}
 
-    if DB.exists():
-        os.remove(DB)
 
-    db.bind(provider="sqlite", filename=str(DB.absolute()), create_db=True)
-    db.generate_mapping(create_tables=True)
+def build_database(rebuild, jobs=1, full=False, immutable=True):
+    """
+    With `rebuild`, bring combined.db up to date with the Plex DBs in `ROOT`.
 
-    for source_db in pathlib.Path().glob("*.db"):
-        # first, snag and align accounts
-        base_name = source_db.stem
-        if base_name == "combined":
-            continue
+    Sources are fingerprinted (`source_fingerprint`) against the manifest stored on the last
+    build; only new or changed ones are extracted, and only rows past their watermarks get
+    appended. Anything that can't be appended to (no manifest yet, a source whose ids went
+    backwards, or `full`) starts over from an empty combined.db.
 
-        print(f"Extracting from {base_name}")
-        extract_accounts(source_db)
-        extract_media(source_db)
-        extract_streams(source_db)
+    Each stage (extracting or merging a source, combining accounts, combining media) is
+    measured by `plexlib.instrument` and appended to its log. Returns those stage records.
+
+    Sources are read as `immutable` (see `connect_source`) unless told otherwise, e.g.
+    while Plex is running. Either way only rows up to their fingerprinted ids are extracted.
+    """
+    if not rebuild:
+        _bind()
+        return []
+
+    try:
+        _build_database(jobs=jobs, full=full, immutable=immutable)
+    finally:
+        # a failed build is the one worth looking at
+        records = write_log()
+    return records
+
+
+def _build_database(jobs, full, immutable):
+
+    fingerprints = {source_db: source_fingerprint(source_db, immutable=immutable) for source_db in source_dbs()}
+    manifest = {} if full else read_manifest()
+    if not can_append(manifest, fingerprints):
+        manifest = {}
+        if DB.exists():
+            os.remove(DB)
+        clear_sketches()
+
+    _bind()
+    with orm.db_session:
+        db.get_connection().set_trace_callback(trace)
+
+    changed = {
+        source_db: manifest.get(source_db.stem, EMPTY_FINGERPRINT)
+        for source_db, fingerprint in fingerprints.items()
+        if manifest.get(source_db.stem) != fingerprint
+    }
+    # a DB Plex is writing to changes all the time, without necessarily anything new to extract
+    grown = {
+        source_db: watermarks
+        for source_db, watermarks in changed.items()
+        if any(fingerprints[source_db][k] > watermarks[k] for k in WATERMARKS)
+    }
+    if not grown:
+        write_manifest({source_db.stem: fingerprints[source_db] for source_db in changed})
+        print("All sources up to date")
+        return
+
+    # each source's rows go in along with its manifest entry, its sketches once they're in,
+    # so a failed build leaves the sources it didn't get through to be extracted again
+    with BulkLoader(DB) as loader:
+        if jobs > 1:
+            extract_parallel(grown, loader, jobs, fingerprints, immutable=immutable)
+        else:
+            for source_db, watermarks in grown.items():
+                print(f"Extracting from {source_db.stem}")
+                with stage("extract", source=source_db.stem), loader.transaction():
+                    sketches = extract_source(
+                        source_db, loader, watermarks, fingerprints[source_db], immutable=immutable
+                    )
+                    loader.replace(Source, {"name": source_db.stem, **fingerprints[source_db]})
+                add_sketches(source_db.stem, sketches)
+
+    write_manifest(
+        {source_db.stem: fingerprints[source_db] for source_db in changed if source_db not in grown}
+    )
 
     # Need to combine overlapping identities over databases
-    combine_accounts()
+    with stage("combine_accounts"):
+        combine_accounts()
     # Need to combine overlapping media over databases
-    combine_media()
+    with stage("combine_media"):
+        combine_media()
+
+
+def _bind():
+    if db.provider is None:
+        db.bind(provider="sqlite", filename=str(DB.absolute()), create_db=True)
+        db.generate_mapping(create_tables=True)
+
+
+def source_dbs():
+    # sorted so that ids in combined.db don't depend on directory order
+    return sorted(p for p in ROOT.glob("*.db") if p.stem not in (DB.stem, DECISIONS.stem))
+
+
+def source_fingerprint(source_db, immutable=True):
+    """File size and mtime, plus the highest ids of the tables we extract from."""
+    stat = source_db.stat()
+    cdb = connect_source(source_db, immutable=immutable)
+    try:
+        max_ids = cdb.execute(
+            """
+            SELECT
+              (SELECT coalesce(max(id), 0) FROM metadata_item_views)
+            , (SELECT coalesce(max(id), 0) FROM media_items)
+            , (SELECT coalesce(max(id), 0) FROM accounts)
+            """
+        ).fetchone()
+    finally:
+        cdb.close()
+
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        **dict(zip(WATERMARKS, max_ids)),
+    }
+
+
+def read_manifest():
+    """Source fingerprints recorded in combined.db, empty if there is none yet."""
+    if not DB.exists():
+        return {}
+    cdb = sqlite3.connect(DB)
+    try:
+        cur = cdb.execute('SELECT * FROM "Source"')
+        cols = [c[0] for c in cur.description]
+        return {row[0]: dict(zip(cols[1:], row[1:])) for row in cur}
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        cdb.close()
 
 
 @orm.db_session
-def extract_accounts(source_db):
-    query = """
+def write_manifest(fingerprints):
+    for name, fingerprint in fingerprints.items():
+        source = Source.get(name=name)
+        if source is None:
+            Source(name=name, **fingerprint)
+        else:
+            source.set(**fingerprint)
+
+
+def can_append(manifest, fingerprints):
+    if not manifest:
+        return False
+    for source_db, fingerprint in fingerprints.items():
+        previous = manifest.get(source_db.stem)
+        # a restored or replaced DB can reuse ids we have already extracted
+        if previous is not None and any(fingerprint[k] < previous[k] for k in WATERMARKS):
+            print(f"{source_db.stem} went backwards, rebuilding from scratch")
+            return False
+    return True
+
+
+def extract_parallel(sources, loader, jobs, fingerprints, immutable=True):
+    """
+    Extract every source (a mapping of source DB to its watermarks) up to its
+    `fingerprints` in its own process into a staging DB, then merge those into `loader`
+    one at a time, in order, so there's only ever a single writer. Each source's manifest
+    entry is written with its rows, its sketches once they're merged.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # spawn, so workers start without the parent's pony binding
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as pool:
+            staged = [
+                pool.submit(
+                    extract_to_staging,
+                    source_db,
+                    pathlib.Path(tmpdir) / f"{source_db.stem}.db",
+                    watermarks,
+                    fingerprints[source_db],
+                    immutable,
+                )
+                for source_db, watermarks in sources.items()
+            ]
+            for source_db, future in zip(sources, staged):
+                staging_db, sketches, record = future.result()
+                STAGES.append(record)
+                print(f"Merging {source_db.stem}")
+                with stage("merge", source=source_db.stem), loader.transaction():
+                    loader.merge(staging_db)
+                    loader.replace(Source, {"name": source_db.stem, **fingerprints[source_db]})
+                add_sketches(source_db.stem, sketches)
+                os.remove(staging_db)
+
+
+def extract_to_staging(source_db, staging_db, watermarks, until, immutable=True):
+    """Runs in a worker, returns the staging DB, its sketches and the record of its extract stage."""
+    print(f"Extracting from {source_db.stem}")
+    # a worker can be handed several sources but pony only binds once, so it maps against
+    # an in-memory DB and each staging DB gets the tables from its create script
+    if db.provider is None:
+        db.bind(provider="sqlite", filename=":memory:")
+        db.generate_mapping(create_tables=False, check_tables=False)
+    sdb = sqlite3.connect(staging_db)
+    sdb.executescript(db.schema.generate_create_script())
+    sdb.close()
+    with stage("extract", source=source_db.stem), BulkLoader(staging_db) as loader:
+        sketches = extract_source(source_db, loader, watermarks, until, immutable=immutable)
+    return staging_db, sketches, STAGES[-1]
+
+
+def extract_source(source_db, loader, watermarks, until, immutable=True) -> dict[str, SpaceSaving]:
+    """
+    Extract the rows of `source_db` past `watermarks` and up to `until` (both fingerprints).
+    Returns the sketches of those views (see `sketch_views`), for the caller to add once
+    the rows are in.
+    """
+    # first, snag and align accounts
+    ids = {k: (watermarks[k], until[k]) for k in WATERMARKS}
+    extract_accounts(source_db, loader, *ids["max_account_id"], immutable=immutable)
+    extract_media(source_db, loader, *ids["max_media_item_id"], immutable=immutable)
+    extract_streams(source_db, loader, *ids["max_view_id"], immutable=immutable)
+    return sketch_views(source_db, *ids["max_view_id"], immutable=immutable)
+
+
+def extract_accounts(source_db, loader, watermark=0, until=None, immutable=True):
+    query = f"""
         SELECT id AS originalid, name
         FROM main.accounts
         WHERE name != ''
+          AND {_id_range("id", watermark, until)}
     """
-    for row in fetch_data_from_db(source_db, query):
-        Account(**row)
-
-    db.commit()
+    loader.insert(Account, fetch_data_from_db(source_db, query, immutable=immutable))
 
 
-@orm.db_session
-def extract_media(source_db):
-    query = """
+def extract_media(source_db, loader, watermark=0, until=None, immutable=True):
+    query = f"""
       SELECT
         mi.id AS originalid
       , mti1.title
@@ -92,19 +292,17 @@ def extract_media(source_db):
         AND mti1.title != ''
         AND media_type IN ('film', 'episode')
         AND mti1.deleted_at IS NULL
+        AND {_id_range("mi.id", watermark, until)}
     """
 
-    for row in fetch_data_from_db(source_db, query):
-        Media(**row)
-
-    db.commit()
+    loader.insert(Media, fetch_data_from_db(source_db, query, immutable=immutable))
 
 
-@orm.db_session
-def extract_streams(source_db):
-    query = """
+def extract_streams(source_db, loader, watermark=0, until=None, immutable=True):
+    query = f"""
         SELECT
-          media_items.id AS original_media_id
+          miv.id AS view_id
+        , media_items.id AS original_media_id
         , DATETIME(viewed_at, 'unixepoch', 'localtime') AS ts
         , a.id AS original_account_id
         , devices.name AS device_name
@@ -120,52 +318,205 @@ def extract_streams(source_db):
           ON media_items.metadata_item_id = mi.id
         LEFT JOIN devices
           ON miv.device_id = devices.id
-        WHERE DATETIME(viewed_at, 'unixepoch', 'localtime') BETWEEN '2023-01-01' AND '2023-12-31'
-          AND original_media_id IS NOT NULL
+        WHERE {_id_range("miv.id", watermark, until)}
+        ORDER BY miv.id
     """
 
-    for row in fetch_data_from_db(source_db, query):
-        s = Stream(**row)
+    # resolve foreign keys from one lookup per table instead of two queries per stream
+    base_name = source_db.stem
+    media_ids = loader.id_map(Media, base_name)
+    account_ids = loader.id_map(Account, base_name)
+
+    # in view order (free, it's the primary key range scan), so views read are counted as
+    # they go by rather than by keeping every id
+    read = 0
+
+    def streams():
+        nonlocal read
+        previous = None
+        for row in fetch_data_from_db(source_db, query, immutable=immutable):
+            if row["view_id"] != previous:
+                read += 1
+                previous = row["view_id"]
+            # a view of media without a file has no duration to count
+            if "original_media_id" not in row:
+                continue
+            yield {
+                **row,
+                "media": media_ids.get(row.get("original_media_id")),
+                "account": account_ids.get(row.get("original_account_id")),
+            }
+
+    loader.insert(Stream, streams())
+    check_views_read(source_db, read, watermark, until, immutable=immutable)
 
-        media_id = row["original_media_id"]
-        account_id = row["original_account_id"]
-        sourcedb = row["sourcedb"]
 
-        if media_id is not None and sourcedb is not None:
-            media = Media.get(sourcedb=sourcedb, originalid=media_id)
-            s.media = media
+def check_views_read(source_db, read, watermark=0, until=None, immutable=True):
+    """
+    Raise unless the `read` distinct views are every view of `source_db` past `watermark`
+    (up to `until`), the range its watermark moves past once the build is done, so no view
+    is ever skipped.
+    """
+    query = f"""
+        SELECT count(DISTINCT miv.id)
+        FROM metadata_item_views miv
+        WHERE {_id_range("miv.id", watermark, until)}
+    """
+    _, [(total,)] = fetch_batches(source_db, query, immutable=immutable)
+    if read != total:
+        raise RuntimeError(
+            f"Read {read} of the {total} views of {source_db.stem} past view {watermark}"
+            f" (up to {until}), its watermark can't move past them"
+        )
 
-        if account_id is not None and sourcedb is not None:
-            account = Account.get(sourcedb=sourcedb, originalid=account_id)
-            s.account = account
 
-    db.commit()
+def sketch_views(source_db, watermark=0, until=None, immutable=True) -> dict[str, SpaceSaving]:
+    """
+    Minutes watched per show, movie and star among the views of `source_db` past
+    `watermark` (up to `until`), as mergeable sketches (see `plexlib.sketch.leaderboards`)
+    named `<year>:<leaderboard>` after the year of the views. Keyed on this source's own
+    titles, so near-duplicates across servers aren't combined.
+    """
+    query = f"""
+        SELECT
+          STRFTIME('%Y', viewed_at, 'unixepoch', 'localtime') AS view_year
+        , mi.metadata_type
+        , mi.title
+        , show.title AS show_title
+        , mi.tags_star
+        , sum((media_items.duration / 1000) / 60) AS duration_minutes
+        FROM metadata_item_views miv
+        JOIN metadata_items mi
+          ON mi.guid = miv.guid
+        JOIN media_items
+          ON media_items.metadata_item_id = mi.id
+        LEFT JOIN metadata_items season
+          ON mi.parent_id = season.id
+        LEFT JOIN metadata_items show
+          ON season.parent_id = show.id
+        WHERE mi.metadata_type IN (1, 4)
+          AND mi.title IS NOT NULL
+          AND mi.title != ''
+          AND mi.deleted_at IS NULL
+          AND {_id_range("miv.id", watermark, until)}
+        GROUP BY view_year, mi.id
+    """
+    counts = defaultdict(lambda: defaultdict(int))
+    batches = fetch_batches(source_db, query, immutable=immutable)
+    next(batches)
+    for rows in batches:
+        for year, metadata_type, title, show_title, tags_star, minutes in rows:
+            if minutes is None:
+                continue
+            if metadata_type == 4:
+                if show_title:
+                    counts[f"{year}:Top show"][show_title.strip()] += minutes
+                continue
+            counts[f"{year}:Top movie"][title.strip()] += minutes
+            for star in (tags_star or "").split("|"):
+                if star:
+                    counts[f"{year}:Top star"][star] += minutes
+    return {name: SpaceSaving.from_counts(weights) for name, weights in counts.items()}
 
 
 @orm.db_session
 def combine_accounts():
-    for account1 in Account.select():
-        for account2 in Account.select():
-            if account1 == account2:
-                continue
-            base_name = account1.name
-            if fuzz.ratio(base_name, account2.name) >= 95 and SuperAccount.get(name=base_name) is None:
-                s = SuperAccount(name=account1.name)
-                account1.super_account = s
-                account2.super_account = s
-                for stream in account1.streams:
-                    stream.super_account = s
-                for stream in account2.streams:
-                    stream.super_account = s
-
-                print(
-                    f"Created SuperAccount[{s.name}] with "
-                    f"{account1.name}@{account1.sourcedb} and {account2.name}@{account2.sourcedb}"
+    fuzz_threshold = 95
+    all_accounts = Account.select().order_by(Account.id)[:]
+    count(rows_read=len(all_accounts))
+    accounts_by_id = {account.id: account for account in all_accounts}
+
+    # accounts linked on an earlier build stay together
+    clusters = DisjointSet(account.id for account in all_accounts)
+    linked = defaultdict(list)
+    for account in all_accounts:
+        if account.super_account is not None:
+            linked[account.super_account.id].append(account.id)
+    for ids in linked.values():
+        for other in ids[1:]:
+            clusters.union(ids[0], other)
+
+    with DecisionStore("account", fuzz_threshold) as decisions:
+        keys = {account.id: (account.sourcedb, account.originalid) for account in all_accounts}
+        ids = {key: id_ for id_, key in keys.items()}
+        # only accounts never scored under their current name get scored, see `DecisionStore`
+        seen = decisions.seen()
+        unseen = {account.id for account in all_accounts if seen.get(keys[account.id]) != account.name}
+        decisions.forget(keys[id_] for id_ in unseen if keys[id_] in seen)
+
+        # unlinked accounts stay apart however else they'd be joined, even by identical names
+        refused = {frozenset(pair) for pair in decisions.decisions("no_match")}
+        for a, b in decisions.decisions("no_match"):
+            if a in ids and b in ids and not clusters.refuse(ids[a], ids[b]):
+                warnings.warn(
+                    f"Can't unlink accounts {a} and {b}, they were combined on an earlier build, rebuild with --full"
                 )
-
-    for account in Account.select():
-        if account.super_account is None:
-            SuperAccount(name=account.name)
+        for a, b in decisions.decisions("match"):
+            if a in ids and b in ids:
+                clusters.union(ids[a], ids[b])
+
+        ids_by_name = defaultdict(list)
+        for account in all_accounts:
+            ids_by_name[account.name].append(account.id)
+        names = sorted(ids_by_name)
+        unseen_names = sorted({accounts_by_id[id_].name for id_ in unseen})
+        scored = []
+        for i, j in fuzzy_pairs(unseen_names, names, fuzz_threshold):
+            if unseen_names[i] == names[j]:
+                continue
+            score = ratio(unseen_names[i], names[j])
+            for a in ids_by_name[unseen_names[i]]:
+                for b in ids_by_name[names[j]]:
+                    if a not in unseen or frozenset((keys[a], keys[b])) in refused:
+                        continue
+                    clusters.union(a, b)
+                    scored.append((keys[a], keys[b], score))
+
+        # identical names are merged outright (unless refused), everything else was decided above
+        rows = [(account.id, account.name) for account in all_accounts]
+        for cluster in cluster_names(rows, fuzz_threshold, clusters=clusters, new=set()):
+            accounts = [accounts_by_id[id_] for id_ in cluster]
+            existing = sorted({a.super_account.id for a in accounts if a.super_account is not None})
+            if not existing:
+                s = SuperAccount(name=accounts[0].name)
+                if len(accounts) > 1:
+                    print(
+                        f"Created SuperAccount[{s.name}] with "
+                        + " and ".join(f"{account.name}@{account.sourcedb}" for account in accounts)
+                    )
+            else:
+                s = SuperAccount[existing[0]]
+                for account in accounts:
+                    if account.super_account != s:
+                        print(f"Added {account.name}@{account.sourcedb} to SuperAccount[{s.name}]")
+
+            for account in accounts:
+                account.super_account = s
+            count(rows_written=len(accounts) + (not existing))
+
+        orm.flush()
+        decisions.record(
+            [(keys[account.id], account.name, account.super_account.id) for account in all_accounts], scored
+        )
+
+    # streams follow their account in one statement instead of walking `account.streams`
+    orm.flush()
+    updated = db.execute(
+        """
+        UPDATE "Stream"
+        SET "super_account" = (SELECT "super_account" FROM "Account" WHERE "Account"."id" = "Stream"."account")
+        WHERE "account" IS NOT NULL
+          AND "super_account" IS NOT (SELECT "super_account" FROM "Account" WHERE "Account"."id" = "Stream"."account")
+        """
+    )
+    # clusters that got bridged by a new account leave their other SuperAccounts empty
+    deleted = db.execute(
+        """
+        DELETE FROM "SuperAccount"
+        WHERE "id" NOT IN (SELECT "super_account" FROM "Account" WHERE "super_account" IS NOT NULL)
+        """
+    )
+    count(rows_written=updated.rowcount + deleted.rowcount)
 
     db.commit()
 
@@ -174,63 +525,192 @@ def combine_accounts():
 def combine_media():
     cols_to_ignore = ("sourcedb", "originalid", "streams", "super_media")
     fuzz_threshold = 85
-    all_media = Media.select()[:]
-    for media1 in tqdm(all_media, total=len(all_media), desc="Combining Media"):
-        for media2 in all_media:
-            # don't create based on the same one
-            if media1 == media2:
-                continue
-
-            # if one's a show, the other is movie? skip it
-            if media1.media_type != media2.media_type:
-                continue
+    rows = db.select(
+        'SELECT "id", "media_type", "title", "parent_title", "super_media", "sourcedb", "originalid" '
+        'FROM "Media" ORDER BY "id"'
+    )
+    count(rows_read=len(rows))
+
+    # media linked on an earlier build keep their SuperMedia, only new ones are combined
+    new_media = {m.id: m for m in Media.select(lambda m: m.super_media is None).order_by(Media.id)}
+    linked = {row[0]: row[4] for row in rows if row[4] is not None}
+
+    with DecisionStore("media", fuzz_threshold) as decisions:
+        keys = {row[0]: (row[5], row[6]) for row in rows}
+        ids = {key: id_ for id_, key in keys.items()}
+        title_keys = {row[0]: _media_key(*row[1:4]) for row in rows}
+        # only media never scored under their current titles get scored, see `DecisionStore`
+        seen = decisions.seen()
+        unseen = {id_ for id_, key in keys.items() if seen.get(key) != repr(title_keys[id_])}
+        decisions.forget(keys[id_] for id_ in unseen if keys[id_] in seen)
+
+        ids_by_key = defaultdict(list)
+        for id_, key in title_keys.items():
+            ids_by_key[key].append(id_)
+        matches = defaultdict(set)
+        for key in ids_by_key:
+            matches[key].add(key)
+
+        # only pairs that share a block get scored, see `plexlib.dedup.match_media`
+        scored = []
+        subset = [row[:4] for row in rows if row[0] in unseen]
+        for key, matched in match_media([row[:4] for row in rows], fuzz_threshold, subset=subset).items():
+            for other in matched:
+                if other == key:
+                    continue
+                matches[key].add(other)
+                matches[other].add(key)
+                score = min(ratio(key[1], other[1]), ratio(key[2], other[2]))
+                scored.extend(
+                    (keys[a], keys[b], score) for a in ids_by_key[key] if a in unseen for b in ids_by_key[other]
+                )
 
+        # earlier and manual decisions; media are combined by titles, so a decision holds for their titles
+        for outcome in ("match", "no_match"):
+            for a, b in decisions.decisions(outcome):
+                if a not in ids or b not in ids:
+                    continue
+                key, other = title_keys[ids[a]], title_keys[ids[b]]
+                if outcome == "match":
+                    matches[key].add(other)
+                    matches[other].add(key)
+                elif key != other:
+                    matches[key].discard(other)
+                    matches[other].discard(key)
+
+        new_by_key = defaultdict(list)
+        linked_by_key = defaultdict(list)
+        for id_, _, _, _, super_media, _, _ in rows:
+            (new_by_key if super_media is None else linked_by_key)[title_keys[id_]].append(id_)
+
+        created = set()
+        for media1 in tqdm(new_media.values(), total=len(new_media), desc="Combining Media"):
             base_title = media1.title
             base_parent_title = media1.parent_title
 
-            same_title = fuzz.ratio(base_title, media2.title) >= fuzz_threshold
-            if not same_title:
+            super_media_exists = (base_title, base_parent_title) in created
+            if super_media_exists:
                 continue
 
-            same_show = (base_parent_title is None and media2.parent_title is None) or (
-                fuzz.ratio(base_parent_title, media2.parent_title) >= fuzz_threshold
-            )
-            if not same_show:
+            matched = matches.get(_media_key(media1.media_type, base_title, base_parent_title), [])
+
+            # first already-combined match (by id) takes it in
+            existing = [linked_by_key[key][0] for key in matched if linked_by_key[key]]
+            if existing:
+                s = SuperMedia[linked[min(existing)]]
+                media1.super_media = s
+                count(rows_written=1)
+                print(f"Added {media1.formatted_name}@{media1.sourcedb} to SuperMedia[{s.formatted_name}]")
                 continue
 
-            super_media_exists = SuperMedia.get(title=base_title, parent_title=base_parent_title) is not None
-            if super_media_exists:
+            # otherwise the first other new media (by id) that matches on type, title and show
+            candidates = []
+            for key in matched:
+                others = [id_ for id_ in new_by_key[key][:2] if id_ != media1.id]
+                if others:
+                    candidates.append(others[0])
+            if not candidates:
                 continue
+            media2 = new_media[min(candidates)]
 
             s = SuperMedia(**{k: v for k, v in media1.to_dict().items() if k not in cols_to_ignore})
+            created.add((base_title, base_parent_title))
             media1.super_media = s
             media2.super_media = s
-            for stream in media1.streams:
-                stream.super_media = s
-            for stream in media2.streams:
-                stream.super_media = s
+            count(rows_written=3)
 
             print(
                 f"Created SuperMedia[{s.formatted_name}] with "
                 f"{media1.formatted_name}@{media1.sourcedb} and {media2.formatted_name}@{media2.sourcedb}"
             )
 
-    for media in Media.select():
-        if media.super_media is None:
-            SuperMedia(**{k: v for k, v in media.to_dict().items() if k not in cols_to_ignore})
+        for media in new_media.values():
+            if media.super_media is None:
+                media.super_media = SuperMedia(
+                    **{k: v for k, v in media.to_dict().items() if k not in cols_to_ignore}
+                )
+                count(rows_written=2)
 
-    db.commit()
+        # streams follow their media in one statement instead of walking `media.streams`
+        orm.flush()
+        updated = db.execute(
+            """
+            UPDATE "Stream"
+            SET "super_media" = (SELECT "super_media" FROM "Media" WHERE "Media"."id" = "Stream"."media")
+            WHERE "media" IS NOT NULL
+              AND "super_media" IS NULL
+            """
+        )
+        count(rows_written=updated.rowcount)
+
+        super_media = dict(db.select('SELECT "id", "super_media" FROM "Media"'))
+        decisions.record([(keys[id_], repr(title_keys[id_]), super_media[id_]) for id_ in keys], scored)
+
+        db.commit()
 
 
-def fetch_data_from_db(dbfile, query):
+def _id_range(column, watermark, until):
+    """SQL condition on `column` past `watermark` and, unless `until` is None, up to it."""
+    condition = f"{column} > {int(watermark)}"
+    if until is not None:
+        condition += f" AND {column} <= {int(until)}"
+    return condition
+
+
+def _media_key(media_type, title, parent_title):
+    return media_type, parent_title or "", title or ""
+
+
+def connect_source(dbfile, immutable=True):
+    """
+    Open a Plex DB read-only. `immutable` additionally skips all locking and change
+    detection, which is only safe while Plex isn't writing to that file.
+    """
+    uri = f"{pathlib.Path(dbfile).absolute().as_uri()}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    return sqlite3.connect(uri, uri=True)
+
+
+def fetch_batches(dbfile, query, batch_size=FETCH_SIZE, immutable=True):
+    """Stream `query` as lists of row tuples, `batch_size` at a time. Yields the column names first."""
+    cdb = connect_source(dbfile, immutable=immutable)
+    try:
+        ccur = cdb.cursor()
+        ccur.execute(query)
+        count(queries=1)
+        yield [c[0] for c in ccur.description]
+        while rows := ccur.fetchmany(batch_size):
+            count(rows_read=len(rows))
+            yield rows
+        ccur.close()
+    finally:
+        cdb.close()
+
+
+def fetch_data_from_db(dbfile, query, batch_size=FETCH_SIZE, immutable=True):
     base_name = dbfile.stem
-    cdb = sqlite3.connect(dbfile)
-    ccur = cdb.cursor()
-    ccur.execute(query)
+    batches = fetch_batches(dbfile, query, batch_size=batch_size, immutable=immutable)
+    cols = next(batches)
+    for rows in batches:
+        for row in rows:
+            yield {"sourcedb": base_name, **{k: v for k, v in zip(cols, row) if v is not None and v != ""}}
 
-    cols = [c[0] for c in ccur.description]
-    for row in ccur.fetchall():
-        yield {"sourcedb": base_name, **{k: v for k, v in zip(cols, row) if v is not None and v != ""}}
 
-    ccur.close()
-    cdb.close()
+def fetch_frames_from_db(dbfile, query, batch_size=FETCH_SIZE, immutable=True):
+    """
+    Like `fetch_data_from_db`, but yields one polars DataFrame per batch (nulls and "" kept
+    as-is), with a `sourcedb` column unless the query has its own. A query without rows
+    yields a single empty frame of its columns, so there is always a schema.
+    """
+    base_name = pathlib.Path(dbfile).stem
+    batches = fetch_batches(dbfile, query, batch_size=batch_size, immutable=immutable)
+    cols = next(batches)
+    empty = True
+    for rows in batches:
+        empty = False
+        df = pl.DataFrame(rows, schema=cols, orient="row", infer_schema_length=None)
+        yield df if "sourcedb" in cols else df.with_columns(sourcedb=pl.lit(base_name))
+    if empty:
+        df = pl.DataFrame(schema=dict.fromkeys(cols, pl.Utf8))
+        yield df if "sourcedb" in cols else df.with_columns(sourcedb=pl.lit(None, dtype=pl.Utf8))
@@ -0,0 +1,143 @@
+# stdlib
+import sqlite3
+import datetime as dt
+
+# local
+from . import ROOT
+
+# kept next to combined.db but not in it, so decisions outlive a rebuild from scratch
+DECISIONS = ROOT / "decisions.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS "Threshold" (
+  "kind" TEXT NOT NULL PRIMARY KEY,
+  "threshold" INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS "Seen" (
+  "kind" TEXT NOT NULL,
+  "sourcedb" TEXT NOT NULL,
+  "originalid" INTEGER NOT NULL,
+  "label" TEXT NOT NULL,
+  "super_id" INTEGER,
+  PRIMARY KEY ("kind", "sourcedb", "originalid")
+);
+CREATE TABLE IF NOT EXISTS "Decision" (
+  "kind" TEXT NOT NULL,
+  "sourcedb" TEXT NOT NULL,
+  "originalid" INTEGER NOT NULL,
+  "other_sourcedb" TEXT NOT NULL,
+  "other_originalid" INTEGER NOT NULL,
+  "score" INTEGER,
+  "outcome" TEXT NOT NULL CHECK ("outcome" IN ('match', 'no_match')),
+  "manual" INTEGER NOT NULL DEFAULT 0,
+  "decided_at" TEXT NOT NULL,
+  PRIMARY KEY ("kind", "sourcedb", "originalid", "other_sourcedb", "other_originalid")
+);
+"""
+
+
+class DecisionStore:
+    """
+    Match decisions of one `kind` of entity (`account` or `media`), keyed on
+    `(sourcedb, originalid)` so they hold across rebuilds of combined.db.
+
+    Every entity that has been scored is `Seen`, with the label (name or titles) it was
+    scored under and the super entity it ended up in. Every pair that matched is a
+    `Decision`, pairs that didn't are all those left out. Manual decisions, either
+    outcome, are never overwritten by scoring and take precedence over it. Scored
+    decisions are dropped when the threshold they were made at changes.
+    """
+
+    def __init__(self, kind, threshold, dbfile=DECISIONS):
+        self.kind = kind
+        self.threshold = threshold
+        self.dbfile = dbfile
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = connect(self.dbfile)
+        previous = self.conn.execute('SELECT "threshold" FROM "Threshold" WHERE "kind" = ?', (self.kind,)).fetchone()
+        if previous is None or previous[0] != self.threshold:
+            self.conn.execute('DELETE FROM "Seen" WHERE "kind" = ?', (self.kind,))
+            self.conn.execute('DELETE FROM "Decision" WHERE "kind" = ? AND NOT "manual"', (self.kind,))
+            self.conn.execute('INSERT OR REPLACE INTO "Threshold" VALUES (?, ?)', (self.kind, self.threshold))
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.conn.commit()
+        self.conn.close()
+        self.conn = None
+
+    def seen(self) -> dict[tuple, str]:
+        """`(sourcedb, originalid) -> label` of everything already scored."""
+        rows = self.conn.execute(
+            'SELECT "sourcedb", "originalid", "label" FROM "Seen" WHERE "kind" = ?', (self.kind,)
+        )
+        return {(sourcedb, originalid): label for sourcedb, originalid, label in rows}
+
+    def decisions(self, outcome) -> list[tuple[tuple, tuple]]:
+        """Every pair of keys decided as `outcome` (`match` or `no_match`)."""
+        rows = self.conn.execute(
+            """
+            SELECT "sourcedb", "originalid", "other_sourcedb", "other_originalid"
+            FROM "Decision"
+            WHERE "kind" = ? AND "outcome" = ?
+            """,
+            (self.kind, outcome),
+        )
+        return [((a, b), (c, d)) for a, b, c, d in rows]
+
+    def record(self, seen, matches):
+        """
+        Store `seen` as `(key, label, super_id)` and `matches` as `(key, other key, score)`.
+        Anything previously recorded for those keys is replaced, manual decisions aside.
+        """
+        now = dt.datetime.now().isoformat(timespec="seconds")
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO "Seen" VALUES (?, ?, ?, ?, ?)',
+            ((self.kind, *key, label, super_id) for key, label, super_id in seen),
+        )
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO "Decision" VALUES (?, ?, ?, ?, ?, ?, \'match\', 0, ?)',
+            ((self.kind, *a, *b, score, now) for a, b, score in (_ordered(a, b) + (score,) for a, b, score in matches)),
+        )
+
+    def forget(self, keys):
+        """Drop the scored decisions of `keys`, e.g. when what they were scored under changed."""
+        self.conn.executemany(
+            """
+            DELETE FROM "Decision"
+            WHERE "kind" = ? AND NOT "manual"
+              AND (("sourcedb" = ? AND "originalid" = ?) OR ("other_sourcedb" = ? AND "other_originalid" = ?))
+            """,
+            ((self.kind, *key, *key) for key in keys),
+        )
+
+
+def connect(dbfile=DECISIONS):
+    conn = sqlite3.connect(dbfile)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def add_override(kind, a, b, outcome, dbfile=DECISIONS):
+    """
+    Manually decide that the entities `a` and `b` (`(sourcedb, originalid)` keys) do or
+    don't match (`outcome` is `match` or `no_match`). Applied on the next build; links
+    already made in combined.db are only undone by a build with `--full`.
+    """
+    a, b = _ordered(tuple(a), tuple(b))
+    conn = connect(dbfile)
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO "Decision" VALUES (?, ?, ?, ?, ?, NULL, ?, 1, ?)',
+            (kind, *a, *b, outcome, dt.datetime.now().isoformat(timespec="seconds")),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _ordered(a, b):
+    return (a, b) if a <= b else (b, a)
@@ -0,0 +1,192 @@
+# stdlib
+from collections import defaultdict
+
+# 3rd party
+import numpy as np
+from rapidfuzz import fuzz, process
+
+# local
+from plexlib.instrument import count
+
+
+def fuzzy_pairs(left: list[str], right: list[str], threshold: int) -> list[tuple[int, int]]:
+    """
+    Every (i, j) such that `thefuzz.fuzz.ratio(left[i], right[j]) >= threshold`.
+
+    `fuzz.ratio` is an indel similarity, so two strings can only score `threshold`
+    if their lengths are close enough. Strings are bucketed by length and each
+    bucket is only scored (vectorized, via `cdist`) against the buckets it could
+    possibly match, which keeps this lossless while skipping most of the matrix.
+    """
+    if not left or not right:
+        return []
+
+    # thefuzz rounds the rapidfuzz score to an int, so anything that rounds up counts
+    cutoff = threshold - 0.5
+    min_ratio = cutoff / 100
+
+    right_by_length = defaultdict(list)
+    for j, s in enumerate(right):
+        right_by_length[len(s)].append(j)
+    right_lengths = np.array(sorted(right_by_length))
+
+    left_by_length = defaultdict(list)
+    for i, s in enumerate(left):
+        left_by_length[len(s)].append(i)
+
+    pairs = []
+    for length, left_idx in left_by_length.items():
+        # ratio <= 2 * min(l1, l2) / (l1 + l2), solve for the other length
+        lo = length * min_ratio / (2 - min_ratio)
+        hi = length * (2 - min_ratio) / min_ratio if min_ratio > 0 else np.inf
+        lengths = right_lengths[(right_lengths >= lo - 1e-9) & (right_lengths <= hi + 1e-9)]
+        if not len(lengths):
+            continue
+        right_idx = [j for l in lengths for j in right_by_length[l]]
+        count(comparisons=len(left_idx) * len(right_idx))
+
+        scores = process.cdist(
+            [left[i] for i in left_idx],
+            [right[j] for j in right_idx],
+            scorer=fuzz.ratio,
+            score_cutoff=cutoff,
+            dtype=np.float64,
+            workers=-1,
+        )
+        for a, b in zip(*np.nonzero(np.round(scores) >= threshold)):
+            pairs.append((left_idx[a], right_idx[b]))
+
+    return pairs
+
+
+def ratio(a: str, b: str) -> int:
+    """The score of a single pair, as `fuzzy_pairs` compares it to the threshold."""
+    return round(fuzz.ratio(a, b))
+
+
+def match_media(rows: list[tuple], threshold: int, subset: list[tuple] = None) -> dict[tuple, list[tuple]]:
+    """
+    Blocked fuzzy matching of media rows.
+
+    `rows` are `(id, media_type, title, parent_title)`. Two rows match when they share a
+    media type and both their titles and parent titles score `threshold`. Identical
+    `(media_type, parent_title, title)` keys are collapsed first, parent titles are matched
+    once per media type, and titles are only scored between groups whose parents matched.
+    With `subset`, only those rows are matched (against all of `rows`).
+
+    Returns a mapping of `(media_type, parent_title, title)` key to every key it matches,
+    including itself.
+    """
+    groups = _group_titles(rows)
+    left_groups = groups if subset is None else _group_titles(subset)
+
+    matches = defaultdict(list)
+    for media_type, left_by_parent in left_groups.items():
+        by_parent = groups.get(media_type, {})
+        left_parents, right_parents = list(left_by_parent), list(by_parent)
+        for i, j in fuzzy_pairs(left_parents, right_parents, threshold):
+            left_parent, right_parent = left_parents[i], right_parents[j]
+            left_titles, right_titles = sorted(left_by_parent[left_parent]), sorted(by_parent[right_parent])
+            for a, b in fuzzy_pairs(left_titles, right_titles, threshold):
+                matches[(media_type, left_parent, left_titles[a])].append(
+                    (media_type, right_parent, right_titles[b])
+                )
+
+    return matches
+
+
+def _group_titles(rows):
+    groups = defaultdict(lambda: defaultdict(set))
+    for _, media_type, title, parent_title in rows:
+        groups[media_type][parent_title or ""].add(title or "")
+    return groups
+
+
+class DisjointSet:
+    """
+    Union-find over arbitrary hashable items, with path halving and union by size.
+
+    Pairs can be kept apart with `refuse`, after which any union that would put them in
+    the same cluster, directly or through other items, is refused.
+    """
+
+    def __init__(self, items=()):
+        self.parent = {}
+        self.size = {}
+        # per root, the items in its cluster and every item refused a cluster with one of them
+        self.members = {}
+        self.refused = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+            self.members[item] = {item}
+            self.refused[item] = set()
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        """Join the clusters of `a` and `b` and return its root, None if that was refused."""
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.refused[a] & self.members[b]:
+            return None
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        self.members[a] |= self.members.pop(b)
+        self.refused[a] |= self.refused.pop(b)
+        return a
+
+    def refuse(self, a, b) -> bool:
+        """Keep `a` and `b` in separate clusters from now on, False if they already share one."""
+        a_root, b_root = self.find(a), self.find(b)
+        if a_root == b_root:
+            return False
+        self.refused[a_root].add(b)
+        self.refused[b_root].add(a)
+        return True
+
+    def groups(self) -> list[list]:
+        """Every cluster, members in insertion order, clusters ordered by their first member."""
+        clusters = defaultdict(list)
+        for item in self.parent:
+            clusters[self.find(item)].append(item)
+        return list(clusters.values())
+
+
+def cluster_names(rows: list[tuple], threshold: int, clusters: DisjointSet = None, new: set = None) -> list[list]:
+    """
+    Transitively cluster `(id, name)` rows whose names score `threshold`.
+
+    Distinct names are scored against each other once, so a user present on every server
+    ends up in a single cluster even if only some of the pairs clear the threshold.
+    `clusters` seeds groupings that are already known, and with `new` (a set of ids) only
+    the names of those rows are scored, against every name.
+    """
+    if clusters is None:
+        clusters = DisjointSet()
+    ids_by_name = defaultdict(list)
+    for id_, name in rows:
+        clusters.add(id_)
+        ids_by_name[name].append(id_)
+    for ids in ids_by_name.values():
+        for other in ids[1:]:
+            clusters.union(ids[0], other)
+
+    names = sorted(ids_by_name)
+    new_names = names if new is None else sorted({name for id_, name in rows if id_ in new})
+    for i, j in fuzzy_pairs(new_names, names, threshold):
+        clusters.union(ids_by_name[new_names[i]][0], ids_by_name[names[j]][0])
+
+    return clusters.groups()
@@ -0,0 +1,45 @@
+# stdlib
+import os
+import shutil
+import pathlib
+import tempfile
+
+
+def atomic_write(path, write):
+    """Write through a temp file in the same directory and rename it over `path`."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def atomic_write_text(path, text):
+    """Replace `path` with `text` whole, so nothing reading it ever sees half of it."""
+    atomic_write(path, lambda f: f.write(text.encode()))
+
+
+def swap_directory(path, write):
+    """
+    Replace the directory `path` whole: `write(tmp)` fills a new directory next to it,
+    which is then swapped in and the old one removed. Nothing is left behind if it fails.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = pathlib.Path(tempfile.mkdtemp(dir=path.parent, prefix=f".{path.name}."))
+    try:
+        write(tmp)
+
+        old = path.with_name(f".{path.name}.old")
+        # left over if a swap was interrupted, it would block the rename
+        shutil.rmtree(old, ignore_errors=True)
+        if path.exists():
+            path.rename(old)
+        tmp.rename(path)
+        shutil.rmtree(old, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
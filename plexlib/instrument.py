@@ -0,0 +1,117 @@
+# stdlib
+import sys
+import json
+import time
+import contextlib
+import datetime as dt
+
+try:
+    import resource
+except ImportError:  # not on windows
+    resource = None
+
+# 3rd party
+import polars as pl
+
+# local
+from . import OUTPUT
+
+STAGES_LOG = OUTPUT / "build_stages.jsonl"
+COUNTERS = ("rows_read", "rows_written", "queries", "comparisons")
+
+# finished stages of this process, in the order they ended
+STAGES = []
+_active = []
+
+
+class Stage:
+    """Wall time, peak memory and counters (see `count`) of one named step of a build."""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.seconds = None
+        self.peak_rss_mb = None
+        self.rss_growth_mb = None
+        self.error = None
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            **self.labels,
+            "seconds": self.seconds,
+            "peak_rss_mb": self.peak_rss_mb,
+            "rss_growth_mb": self.rss_growth_mb,
+            **self.counters,
+            "error": self.error,
+        }
+
+
+@contextlib.contextmanager
+def stage(name, **labels):
+    """
+    Measure the enclosed block as stage `name` (`labels`, e.g. `source=...`, are recorded
+    alongside) and add it to `STAGES` once it ends, whether it succeeded or not.
+    """
+    s = Stage(name, **labels)
+    rss_before = peak_rss_mb()
+    _active.append(s)
+    start = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.seconds = time.perf_counter() - start
+        _active.remove(s)
+        s.peak_rss_mb = peak_rss_mb()
+        if rss_before is not None:
+            s.rss_growth_mb = s.peak_rss_mb - rss_before
+        STAGES.append(s.as_dict())
+
+
+def count(**counters):
+    """Add to the counters of every stage currently running, a no-op outside of one."""
+    for s in _active:
+        for counter, n in counters.items():
+            s.counters[counter] += n
+
+
+def trace(statement):
+    """sqlite3 trace callback (`conn.set_trace_callback(trace)`) counting every statement run."""
+    count(queries=1)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MiB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB everywhere else
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def write_log(path=STAGES_LOG):
+    """Append every stage recorded so far to `path`, one JSON object per line, and return them."""
+    run = dt.datetime.now().isoformat(timespec="seconds")
+    records = [{"run": run, **record} for record in STAGES]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    STAGES.clear()
+    return records
+
+
+def summary(records) -> pl.DataFrame:
+    """Stage records as a table, slowest first."""
+    if not records:
+        return pl.DataFrame()
+    return (
+        pl.DataFrame(records, infer_schema_length=None)
+        .drop("run")
+        .with_columns(pl.col("seconds", "peak_rss_mb", "rss_growth_mb").round(2))
+        .sort("seconds", descending=True)
+    )
@@ -0,0 +1,207 @@
+# stdlib
+import sqlite3
+import itertools
+from contextlib import contextmanager
+
+# local
+from plexlib.instrument import count
+from plexlib.schema import Account, Media, Stream
+
+BATCH_SIZE = 10_000
+
+# only held while loading, the connection is closed (and these forgotten) afterwards
+LOAD_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -256_000,  # KiB
+    "temp_store": "MEMORY",
+}
+
+
+def entity_columns(entity) -> list:
+    """Every stored, non-pk attribute of a mapped pony entity."""
+    return [attr for attr in entity._attrs_ if not attr.is_collection and not attr.is_pk and attr.column is not None]
+
+
+def to_sql(attr, value):
+    """Coerce a raw value the way pony would store it (stripped strings, its datetime format, ...)."""
+    if value is None:
+        return attr.default
+    converter = attr.converters[0]
+    return converter.py2sql(converter.validate(value))
+
+
+class BulkLoader:
+    """
+    Write rows straight into the tables of `plexlib.schema`, bypassing pony.
+
+    Tables must already exist (`db.generate_mapping(create_tables=True)`). While the loader
+    is open their secondary indexes are dropped and the connection runs with `LOAD_PRAGMAS`;
+    rows go in with `executemany`, one transaction per `batch_size` rows (or per block, see
+    `transaction`), and the indexes are rebuilt on close. Rows are taken lazily so memory
+    stays bounded by the batch size.
+    """
+
+    def __init__(self, dbfile, batch_size=BATCH_SIZE, entities=(Account, Media, Stream)):
+        self.dbfile = dbfile
+        self.batch_size = batch_size
+        self.tables = [entity._table_ for entity in entities]
+        self.conn = None
+        self.indexes = []
+        self.deferred = False
+        # staging DBs merged within a transaction, SQLite only detaches them after it ends
+        self.attached = []
+
+    def __enter__(self):
+        self.conn = sqlite3.connect(self.dbfile)
+        for pragma, value in LOAD_PRAGMAS.items():
+            self.conn.execute(f"PRAGMA {pragma} = {value}")
+
+        placeholders = ", ".join("?" for _ in self.tables)
+        self.indexes = self.conn.execute(
+            f"""
+            SELECT name, sql
+            FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+            """,
+            self.tables,
+        ).fetchall()
+        for name, _ in self.indexes:
+            self.conn.execute(f'DROP INDEX "{name}"')
+        self.conn.commit()
+        return self
+
+    def __exit__(self, *exc):
+        for _, sql in self.indexes:
+            self.conn.execute(sql)
+        self.conn.commit()
+        self.conn.execute("PRAGMA optimize")
+        self.conn.close()
+        self.conn = None
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commit everything written within the block at once, or roll all of it back if the
+        block fails, e.g. a source's rows along with its manifest entry.
+        """
+        self.deferred = True
+        try:
+            yield self
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+        finally:
+            self.deferred = False
+            for name in self.attached:
+                self.conn.execute(f"DETACH DATABASE {name}")
+            self.attached = []
+
+    def _commit(self):
+        if not self.deferred:
+            self.conn.commit()
+
+    def insert(self, entity, rows) -> int:
+        """Insert an iterable of attribute dicts (as given to `entity(**row)`), returns the row count."""
+        columns = entity_columns(entity)
+        names = ", ".join(f'"{attr.column}"' for attr in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        sql = f'INSERT INTO "{entity._table_}" ({names}) VALUES ({placeholders})'
+
+        n = 0
+        rows = iter(rows)
+        while batch := list(itertools.islice(rows, self.batch_size)):
+            self.conn.executemany(
+                sql,
+                (tuple(to_sql(attr, row.get(attr.name)) for attr in columns) for row in batch),
+            )
+            self._commit()
+            count(rows_written=len(batch), queries=1)
+            n += len(batch)
+        return n
+
+    def merge(self, staging_db):
+        """
+        Append everything from another DB written by a `BulkLoader` (same tables, ids from 1).
+
+        Accounts and media get ids past the ones already loaded, so merging staging DBs in a
+        fixed order gives the same ids as loading them sequentially. Stream foreign keys are
+        re-resolved against everything loaded so far, as streams in an appended batch can
+        point at media or accounts from an earlier build.
+        """
+        self.conn.execute("ATTACH DATABASE ? AS staging", (str(staging_db),))
+        if self.deferred:
+            self.attached.append("staging")
+        for entity in (Account, Media):
+            table = entity._table_
+            offset = self.conn.execute(f'SELECT coalesce(max("id"), 0) FROM main."{table}"').fetchone()[0]
+            names = ", ".join(f'"{attr.column}"' for attr in entity_columns(entity))
+            inserted = self.conn.execute(
+                f"""
+                INSERT INTO main."{table}" ("id", {names})
+                SELECT "id" + {offset}, {names}
+                FROM staging."{table}"
+                ORDER BY "id"
+                """
+            )
+            count(rows_written=inserted.rowcount, queries=1)
+
+            # (sourcedb, originalid) -> id, last one wins like `id_map`
+            self.conn.execute(f'DROP TABLE IF EXISTS temp."{table}_ids"')
+            self.conn.execute(
+                f"""
+                CREATE TEMP TABLE "{table}_ids" (
+                  "sourcedb" TEXT, "originalid" INTEGER, "id" INTEGER, PRIMARY KEY ("sourcedb", "originalid")
+                )
+                """
+            )
+            self.conn.execute(
+                f"""
+                INSERT OR REPLACE INTO temp."{table}_ids"
+                SELECT "sourcedb", "originalid", "id"
+                FROM main."{table}"
+                WHERE "sourcedb" IN (SELECT DISTINCT "sourcedb" FROM staging."Stream")
+                ORDER BY "id"
+                """
+            )
+
+        columns = [attr.column for attr in entity_columns(Stream) if attr.column not in ("account", "media")]
+        names = ", ".join(f'"{column}"' for column in columns)
+        inserted = self.conn.execute(
+            f"""
+            INSERT INTO main."Stream" ({names}, "account", "media")
+            SELECT {", ".join(f's."{column}"' for column in columns)}, a."id", m."id"
+            FROM staging."Stream" s
+            LEFT JOIN temp."Account_ids" a
+              ON a."sourcedb" = s."sourcedb" AND a."originalid" = s."original_account_id"
+            LEFT JOIN temp."Media_ids" m
+              ON m."sourcedb" = s."sourcedb" AND m."originalid" = s."original_media_id"
+            ORDER BY s."id"
+            """
+        )
+        count(rows_written=inserted.rowcount, queries=1)
+        self.conn.execute('DROP TABLE temp."Account_ids"')
+        self.conn.execute('DROP TABLE temp."Media_ids"')
+        self._commit()
+        if not self.deferred:
+            self.conn.execute("DETACH DATABASE staging")
+
+    def replace(self, entity, row):
+        """Write one attribute dict of `entity`, over the row with the same primary key if there is one."""
+        columns = [*entity._pk_attrs_, *entity_columns(entity)]
+        names = ", ".join(f'"{attr.column}"' for attr in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        self.conn.execute(
+            f'INSERT OR REPLACE INTO "{entity._table_}" ({names}) VALUES ({placeholders})',
+            tuple(to_sql(attr, row.get(attr.name)) for attr in columns),
+        )
+        count(rows_written=1, queries=1)
+        self._commit()
+
+    def id_map(self, entity, sourcedb) -> dict[int, int]:
+        """`originalid -> id` for every row of `entity` loaded from `sourcedb`."""
+        return dict(
+            self.conn.execute(f'SELECT "originalid", "id" FROM "{entity._table_}" WHERE "sourcedb" = ?', (sourcedb,))
+        )
@@ -0,0 +1,97 @@
+# 3rd party
+import polars as pl
+
+# local
+from plexlib import DB, with_cache
+from plexlib.compact import compact
+from plexlib.data import fetch_frames_from_db
+from plexlib.rollup import view_labels
+
+# what cache entries and the rollup record local views as coming from, their ids hold across builds
+SOURCE = "combined.db"
+
+# plex metadata types as the snowflake base table labels them
+MEDIA_TYPES = {"episode": "TV Series", "film": "Movie"}
+
+BASE_QUERY = """
+    SELECT
+      s.id AS stream_id
+    , s.sourcedb
+    , sa.name AS user
+    , s.ts AS viewed_at
+    , s.device_name
+    , s.device_platform
+    , sm.id AS media_id
+    , sm.media_type
+    , sm.title
+    , NULLIF(sm.parent_title, '') AS grandparent_title
+    , NULLIF(sm.studio, '') AS studio
+    , sm.rating
+    , sm.audience_rating
+    , NULLIF(sm.content_rating, '') AS content_rating
+    , sm.duration_minutes
+    , NULLIF(sm.summary, '') AS summary
+    , sm.year
+    , sm.release_date
+    , sm.added_date
+    , NULLIF(sm.tags_genre, '') AS tags_genre
+    , NULLIF(sm.tags_director, '') AS tags_director
+    , NULLIF(sm.tags_writer, '') AS tags_writer
+    , NULLIF(sm.tags_star, '') AS tags_star
+    , NULLIF(sm.tags_country, '') AS tags_country
+    FROM "Stream" s
+    JOIN "SuperMedia" sm
+      ON sm.id = s.super_media
+    LEFT JOIN "SuperAccount" sa
+      ON sa.id = s.super_account
+    WHERE s.id > {after}
+    ORDER BY s.id
+"""
+
+# the base frame's `plexlib.rollup.LABELS` columns alone
+LABELS_QUERY = """
+    SELECT s.id AS stream_id, sa.name AS user, sm.id AS media_id
+    FROM "Stream" s
+    JOIN "SuperMedia" sm
+      ON sm.id = s.super_media
+    LEFT JOIN "SuperAccount" sa
+      ON sa.id = s.super_account
+    WHERE s.id <= {through}
+"""
+
+
+def load_local_dataset() -> pl.LazyFrame:
+    """
+    The denormalized base frame (what snowflake's plex_wrapped_2023_base holds), built
+    straight from combined.db and cached until combined.db changes.
+    """
+    stat = DB.stat()
+    return _load_local_dataset(str(DB.absolute()), stat.st_size, stat.st_mtime_ns)
+
+
+def load_local_views(after) -> pl.DataFrame:
+    """The rows of the base frame for streams past the id `after`, uncached, e.g. to follow a live build."""
+    return compact(_read_views(str(DB.absolute()), after))
+
+
+def local_view_labels(through) -> tuple[int, int]:
+    """
+    How many rows of the base frame are for streams up to the id `through`, and the digest
+    of who watched what in them, as `plexlib.rollup.view_labels` has it.
+    """
+    frames = fetch_frames_from_db(str(DB.absolute()), LABELS_QUERY.format(through=int(through)))
+    return view_labels(pl.concat(frames, how="diagonal_relaxed"))
+
+
+@with_cache(source=SOURCE, lazy=True, normalize=compact)
+def _load_local_dataset(dbfile, size, mtime):
+    return _read_views(dbfile, after=0)
+
+
+def _read_views(dbfile, after):
+    frames = fetch_frames_from_db(dbfile, BASE_QUERY.format(after=int(after)))
+    return pl.concat(frames, how="diagonal_relaxed").with_columns(
+        pl.col("viewed_at").cast(pl.Utf8).str.to_datetime("%Y-%m-%d %H:%M:%S%.f"),
+        pl.col("release_date", "added_date").cast(pl.Utf8).str.to_date("%Y-%m-%d"),
+        pl.col("media_type").replace(MEDIA_TYPES),
+    )
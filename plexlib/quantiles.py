@@ -0,0 +1,133 @@
+# stdlib
+import math
+
+# 3rd party
+import numpy as np
+import polars as pl
+
+COMPRESSION = 100
+
+
+class TDigest:
+    """
+    A merging t-digest (Dunning & Ertl): a distribution summarized as weighted centroids,
+    small ones at the tails and larger ones in the middle, at most about `compression` of
+    them however many values went in. Digests merge by pooling their centroids, so they
+    can be built per user, source or month and combined later.
+    """
+
+    def __init__(self, means=(), weights=(), compression=COMPRESSION, lo=math.inf, hi=-math.inf):
+        self.means = np.asarray(means, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.compression = compression
+        self.lo = lo
+        self.hi = hi
+
+    @classmethod
+    def from_values(cls, values, weights=None, compression=COMPRESSION) -> "TDigest":
+        values = np.asarray(values, dtype=np.float64)
+        weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=np.float64)
+        keep = ~np.isnan(values)
+        values, weights = values[keep], weights[keep]
+        if not len(values):
+            return cls(compression=compression)
+        return cls(values, weights, compression, values.min(), values.max())._compress()
+
+    @property
+    def total(self):
+        return self.weights.sum()
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        return TDigest(
+            np.concatenate([self.means, other.means]),
+            np.concatenate([self.weights, other.weights]),
+            max(self.compression, other.compression),
+            min(self.lo, other.lo),
+            max(self.hi, other.hi),
+        )._compress()
+
+    def _compress(self):
+        if not len(self.means):
+            return self
+        # equal values first, so a handful of distinct values stays exact
+        means, inverse = np.unique(self.means, return_inverse=True)
+        weights = np.bincount(inverse, weights=self.weights)
+
+        total = weights.sum()
+        merged_means, merged_weights = [means[0]], [weights[0]]
+        done = 0.0
+        for mean, weight in zip(means[1:], weights[1:]):
+            proposed = merged_weights[-1] + weight
+            # k1 scale function, a centroid may span at most one unit of k
+            if self._k((done + proposed) / total) - self._k(done / total) <= 1:
+                merged_means[-1] += (mean - merged_means[-1]) * weight / proposed
+                merged_weights[-1] = proposed
+            else:
+                done += merged_weights[-1]
+                merged_means.append(mean)
+                merged_weights.append(weight)
+
+        self.means = np.array(merged_means)
+        self.weights = np.array(merged_weights)
+        return self
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def quantile(self, q) -> float:
+        """
+        The value at rank `q` like polars' `interpolation="nearest"`: of the value sorted at
+        `round(q * (n - 1))`, or of the centroid holding that rank.
+        """
+        if not len(self.means):
+            return None
+        if q <= 0:
+            return self.lo
+        if q >= 1:
+            return self.hi
+        rank = math.floor(q * (self.total - 1) + 0.5)
+        return float(self.means[np.searchsorted(np.cumsum(self.weights), rank, side="right")])
+
+    def to_dict(self):
+        return {
+            "compression": self.compression,
+            "lo": self.lo,
+            "hi": self.hi,
+            "means": self.means.tolist(),
+            "weights": self.weights.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["means"], d["weights"], d["compression"], d["lo"], d["hi"])
+
+
+def quantile_sketches(df, by, value, weight=None, compression=COMPRESSION) -> dict[tuple, TDigest]:
+    """
+    One digest of `value` per group of `by` (e.g. `["user"]`, `["user", "sourcedb"]` or a
+    month), with rows counted `weight` times if given. Equal values are pooled by polars
+    first, so each group is digested in a single pass over its distinct values.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    counts = (
+        df.lazy()
+        .filter(pl.col(value).is_not_null())
+        .group_by(*by, value)
+        .agg((pl.col(weight).sum() if weight else pl.count()).alias("weight"))
+        .group_by(*by)
+        .agg(value, "weight")
+        .collect()
+    )
+    return {
+        tuple(row[:-2]): TDigest.from_values(row[-2], row[-1], compression=compression)
+        for row in counts.iter_rows()
+    }
+
+
+def merge_sketches(*sketches: dict[tuple, TDigest]) -> dict[tuple, TDigest]:
+    """Merge per group digests, e.g. of several sources or months."""
+    merged = {}
+    for digests in sketches:
+        for key, digest in digests.items():
+            merged[key] = merged[key].merge(digest) if key in merged else digest
+    return merged
@@ -0,0 +1,139 @@
+# stdlib
+import html
+import json
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+# 3rd party
+import polars as pl
+
+# local
+from . import OUTPUT
+from .files import atomic_write_text
+from .stats import questions, run_questions, user_digests
+
+REPORTS = OUTPUT / "reports"
+# what the reports were written from, dotted so it can't be a user's report (see `_stem`)
+META = ".reports.json"
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Plex Wrapped: {user}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em auto; max-width: 60em; }}
+table {{ border-collapse: collapse; margin-bottom: 2em; }}
+th, td {{ border-bottom: 1px solid #ccc; padding: 0.25em 0.75em; text-align: left; }}
+</style>
+</head>
+<body>
+<h1>Plex Wrapped: {user}</h1>
+{sections}
+</body>
+</html>
+"""
+
+
+def write_reports(df, tables=None, jobs=1, force=False, path=REPORTS) -> list[str]:
+    """
+    A report of every user question for every user, `<user>.json` and `<user>.html` under
+    `path` (the name quoted like the store's partitions, see `_stem`). Returns the users
+    written.
+
+    Users whose digest (see `plexlib.stats.user_digests`) is the one their report was
+    written from are skipped, unless `force`. The others are answered together, in a
+    single pass grouped by user, split up afterwards and rendered `jobs` at a time.
+    `tables` are the session tables, as for `run_questions`.
+    """
+    tables = tables or {}
+    stamp = {
+        "questions": [q.name for q in questions(scope="user")],
+        "tables": sorted(tables),
+        "polars": pl.__version__,
+    }
+    meta = report_meta(path)
+    written = meta.get("users", {}) if meta.get("stamp") == stamp and not force else {}
+
+    digests = user_digests(df, tables=tables)
+    # views of deleted accounts have no one to report to
+    digests.pop(None, None)
+    changed = sorted(user for user, digest in digests.items() if written.get(user) != digest)
+
+    path.mkdir(parents=True, exist_ok=True)
+    for user in set(meta.get("users", {})) - set(digests):
+        for suffix in (".json", ".html"):
+            (path / f"{_stem(user)}{suffix}").unlink(missing_ok=True)
+
+    if changed:
+        answers = defaultdict(dict)
+        only = {name: _only(table, changed) for name, table in tables.items()}
+        results = run_questions(_only(df, changed), scope="user", tables=only)
+        for name, X in results.items():
+            for user in changed:
+                answers[user][name] = []
+            for row in X.with_columns(pl.col("user").cast(pl.Utf8)).to_dicts():
+                answers[row.pop("user")][name].append(row)
+        reports = [(path, user, digests[user], answers[user]) for user in changed]
+        if jobs > 1:
+            # spawn, like the extract workers, rather than fork a process polars has threads in
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as pool:
+                list(pool.map(render_report, *zip(*reports), chunksize=max(1, len(reports) // (jobs * 4))))
+        else:
+            for report in reports:
+                render_report(*report)
+
+    atomic_write_text(path / META, json.dumps({"stamp": stamp, "users": digests}, indent=2))
+    return changed
+
+
+def report_meta(path=REPORTS) -> dict:
+    try:
+        return json.loads((path / META).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def render_report(path, user, digest, answers):
+    """Runs in a worker, writes the JSON and HTML report of `user` from their `answers`."""
+    stem = _stem(user)
+    report = {"user": user, "digest": digest, "questions": answers}
+    atomic_write_text(path / f"{stem}.json", json.dumps(report, indent=2, default=str))
+    atomic_write_text(path / f"{stem}.html", render_html(user, answers))
+
+
+def render_html(user, answers) -> str:
+    sections = []
+    for name, rows in answers.items():
+        sections.append(f"<h2>{html.escape(name)}</h2>")
+        if not rows:
+            sections.append("<p>Nothing to show.</p>")
+            continue
+        header = "".join(f"<th>{html.escape(column)}</th>" for column in rows[0])
+        body = "".join(
+            "<tr>" + "".join(f"<td>{html.escape(_format(value))}</td>" for value in row.values()) + "</tr>"
+            for row in rows
+        )
+        sections.append(f"<table><tr>{header}</tr>{body}</table>")
+    return PAGE.format(user=html.escape(user), sections="\n".join(sections))
+
+
+def _format(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    return str(value)
+
+
+def _stem(user) -> str:
+    # quoting keeps dots, a leading one is escaped too so no report is hidden or is `META`
+    stem = quote(user, safe="")
+    return f"%2E{stem[1:]}" if stem.startswith(".") else stem
+
+
+def _only(frame, users) -> pl.LazyFrame:
+    return frame.lazy().filter(pl.col("user").cast(pl.Utf8).is_in(users))
@@ -0,0 +1,169 @@
+# stdlib
+import json
+import warnings
+
+# 3rd party
+import polars as pl
+
+# local
+from . import OUTPUT
+from .compact import ID_COLUMNS, LEXICAL
+from .files import swap_directory
+
+ROLLUP = OUTPUT / "rollup"
+
+KEYS = ["user", "media_id", "day", "hour", "weekday", "media_type"]
+# what a question needs to know about a media, looked up once per media instead of per view
+MEDIA_COLUMNS = [
+    "media_id",
+    "title",
+    "grandparent_title",
+    "rating",
+    "tags_genre",
+    "tags_star",
+    "tags_director",
+    "tags_country",
+]
+
+
+# what the rollup reads of every view, `KEYS` aside from `media_id` come from `viewed_at`
+VIEW_COLUMNS = ["user", "viewed_at", "media_type", "duration_minutes", *MEDIA_COLUMNS]
+
+
+# who watched what, which a build can change for views already rolled up, e.g. by linking
+# accounts. Hashed to 32 bits so that sums of them stay exact
+LABELS = (
+    (pl.struct(pl.col("stream_id", "media_id").cast(pl.Int64), pl.col("user").cast(pl.Utf8)).hash() % 2**32)
+    .sum()
+    .alias("labels")
+)
+
+
+def view_labels(views) -> tuple[int, int]:
+    """How many `views` there are, and a digest of their `LABELS` that doesn't depend on their order."""
+    return views.lazy().select(pl.count(), LABELS.cast(pl.Int64)).collect().row(0)
+
+
+def with_view_time(views: pl.LazyFrame) -> pl.LazyFrame:
+    """Views with the time columns of `KEYS` and a `views` count of 1 each, the shape of `rollup_base`."""
+    return views.with_columns(
+        day=pl.col("viewed_at").dt.date(),
+        hour=pl.col("viewed_at").dt.hour(),
+        weekday=pl.col("viewed_at").dt.weekday(),
+        views=pl.lit(1, dtype=pl.UInt32),
+    )
+
+
+def rollup(views: pl.LazyFrame) -> tuple[pl.LazyFrame, pl.LazyFrame]:
+    """Minutes and view counts of `views` per `KEYS`, and the attributes of every media in it."""
+    missing = sorted(set(VIEW_COLUMNS) - set(views.columns))
+    if missing:
+        raise KeyError(f"Views missing columns the rollup needs: {missing}")
+    views = views.with_columns(pl.col("media_id").cast(ID_COLUMNS["media_id"]))
+    cube = (
+        with_view_time(views)
+        .group_by(KEYS)
+        .agg(pl.col("duration_minutes").sum(), pl.col("views").sum())
+    )
+    media = views.select(MEDIA_COLUMNS).unique("media_id", keep="first", maintain_order=True)
+    return cube, media
+
+
+def sync_rollup(views, path=ROLLUP, source=None) -> pl.LazyFrame:
+    """
+    Bring the rollup at `path` up to date with `views` and scan it (see `rollup_base`).
+
+    Only views past the highest `stream_id` already rolled up get aggregated and merged in,
+    as long as the ones up to it are still all there, with the same users and media (see
+    `view_labels`), and they come from the same `source` (whatever the views can be
+    appended within, e.g. combined.db, or one snowflake fetch). Otherwise (combined.db was
+    rebuilt or relinked, a refetch, views without a `stream_id`, no rollup yet) it is
+    rebuilt from every view.
+    """
+    views = views.lazy()
+    meta = rollup_meta(path)
+    if meta.get("source") != source:
+        meta = {}
+
+    if "stream_id" not in views.columns:
+        cube, media = rollup(views)
+        return _rollup_base(cube, media)
+
+    watermark = meta.get("watermark")
+    if watermark is not None:
+        seen = view_labels(views.filter(pl.col("stream_id") <= watermark))
+        if seen != (meta["views"], meta.get("labels")):
+            watermark = None
+
+    if watermark is None:
+        return append_rollup(views, path, meta={}, source=source)
+    return append_rollup(views.filter(pl.col("stream_id") > watermark), path, meta=meta, source=source)
+
+
+def append_rollup(new, path=ROLLUP, meta=None, source=None) -> pl.LazyFrame:
+    """
+    Merge `new` views, all past the watermark of the rollup at `path`, into it and scan it.
+    With `meta={}` the rollup is started over from `new`, recording `source` (see `sync_rollup`).
+    """
+    new = new.lazy()
+    meta = rollup_meta(path) if meta is None else meta
+    watermark = meta.get("watermark")
+
+    if watermark is None:
+        cube, media = rollup(new)
+    else:
+        if new.select(pl.count()).collect().item() == 0:
+            return rollup_base(path)
+        new_cube, new_media = rollup(new)
+        cube = (
+            pl.concat([_scan(path / "cube.parquet"), new_cube], how="vertical_relaxed")
+            .group_by(KEYS)
+            .agg(pl.col("duration_minutes").sum(), pl.col("views").sum())
+        )
+        old_media = _scan(path / "media.parquet")
+        media = pl.concat([old_media, new_media.join(old_media, on="media_id", how="anti")], how="vertical_relaxed")
+
+    with warnings.catch_warnings():
+        # the rollup's files and the new views each have their own dictionaries for
+        # categorical columns, merging them re-encodes by design
+        warnings.simplefilter("ignore", pl.exceptions.CategoricalRemappingWarning)
+        cube, media = pl.collect_all([cube, media])
+    stats = new.select(pl.col("stream_id").max(), pl.count(), LABELS.cast(pl.Int64)).collect().row(0)
+    meta = {
+        "source": source if watermark is None else meta.get("source"),
+        "watermark": stats[0] if watermark is None else max(watermark, stats[0]),
+        "views": stats[1] if watermark is None else meta["views"] + stats[1],
+        "labels": stats[2] if watermark is None else meta["labels"] + stats[2],
+        "rows": cube.height,
+    }
+
+    def write(tmp):
+        cube.write_parquet(tmp / "cube.parquet", statistics=True)
+        media.write_parquet(tmp / "media.parquet", statistics=True)
+        (tmp / "rollup.json").write_text(json.dumps(meta))
+
+    swap_directory(path, write)
+    return rollup_base(path)
+
+
+def rollup_meta(path=ROLLUP) -> dict:
+    try:
+        return json.loads((path / "rollup.json").read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def rollup_base(path=ROLLUP) -> pl.LazyFrame:
+    """The rollup at `path` joined to its media, one row per `KEYS` with summed `duration_minutes` and `views`."""
+    return _rollup_base(_scan(path / "cube.parquet"), _scan(path / "media.parquet"))
+
+
+def _rollup_base(cube, media):
+    return cube.join(media, on="media_id", how="left")
+
+
+def _scan(datafile):
+    # rollups written before ids had a fixed width have whatever the first load narrowed them to
+    return pl.scan_parquet(datafile).with_columns(
+        pl.col(pl.Categorical).cast(LEXICAL), pl.col("media_id").cast(ID_COLUMNS["media_id"])
+    )
@@ -105,3 +105,13 @@ class Stream(db.Entity):
     media = orm.Optional("Media")
     super_account = orm.Optional("SuperAccount")
     super_media = orm.Optional("SuperMedia")
+
+
+# fingerprint of a source Plex DB as of its last extraction, see `plexlib.data.source_fingerprint`
+class Source(db.Entity):
+    name = orm.PrimaryKey(str)
+    size = orm.Required(int, size=64)
+    mtime = orm.Required(float)
+    max_view_id = orm.Required(int, size=64)
+    max_media_item_id = orm.Required(int, size=64)
+    max_account_id = orm.Required(int, size=64)
@@ -0,0 +1,181 @@
+# stdlib
+import json
+
+# 3rd party
+import polars as pl
+
+# local
+from . import OUTPUT
+from .compact import LEXICAL
+from .files import swap_directory
+
+SESSIONS = OUTPUT / "sessions"
+
+# a view starting more than this long after everything before it ended starts a new session
+SESSION_GAP_MINUTES = 30
+# this many episodes of a show in a row, within a session, make a binge
+BINGE_EPISODES = 3
+# a view overlapping earlier ones by at least this much was playing alongside them
+CONCURRENT_MINUTES = 5
+
+# sort keys are a user's code times this plus the epoch second, good until the year 2242
+USER_STRIDE = 2**33
+
+# bumped whenever `sessionize` changes what it computes, so tables written before get redone
+VERSION = 3
+
+VIEW_COLUMNS = ["stream_id", "user", "viewed_at", "device_name", "media_type", "title", "grandparent_title"]
+
+
+def sessionize(
+    views, gap=SESSION_GAP_MINUTES, binge=BINGE_EPISODES, concurrent=CONCURRENT_MINUTES
+) -> pl.LazyFrame:
+    """
+    Every view with the session and run of episodes it belongs to.
+
+    Plex records a view once it's (nearly) watched, so a view is taken to have played for
+    its `duration_minutes` up to `viewed_at`, from `started_at`; one without a duration
+    as taking none. Views are sorted by user and `started_at` once, then:
+
+    - `overlap_minutes` is how much of the view played while a view of the same user that
+      started before it was still playing (up to the latest end among them), and
+      `concurrent` flags those overlapping by `concurrent` minutes or more, e.g. two
+      devices at once. `counted_minutes` is the rest of the view, so summing it gives the
+      time the user spent watching, without counting the same minutes twice.
+    - `session_id` starts over after a break of more than `gap` minutes.
+    - `run_id` starts over with the session, or whenever the show changes or a non episode
+      comes in between; `binge` flags runs of at least `binge` episodes.
+    """
+    missing = sorted({*VIEW_COLUMNS, "duration_minutes"} - set(views.lazy().columns))
+    if missing:
+        raise KeyError(f"Views missing columns sessions need: {missing}")
+    # one integer sort key instead of sorting on (user, started_at), which is several times
+    # slower: any order of users will do, so their categorical codes, above the seconds.
+    # Views of deleted accounts have no user, they go below everyone's as the code -1
+    user = pl.col("user").cast(pl.Categorical).to_physical().cast(pl.Int64).fill_null(-1) * USER_STRIDE
+    ended = user + pl.col("viewed_at").dt.epoch("s")
+    episode = (pl.col("media_type") == "TV Series").fill_null(False)
+    first = pl.col("_user").ne_missing(pl.col("_user").shift(1))
+    row = pl.int_range(0, pl.count(), dtype=pl.Int64)
+
+    return (
+        views.lazy()
+        .select(*VIEW_COLUMNS, "duration_minutes")
+        .filter(pl.col("viewed_at").is_not_null())
+        .with_columns(pl.col("duration_minutes").fill_null(0))
+        .with_columns(
+            pl.col("viewed_at").dt.cast_time_unit("us"),
+            _user=user,
+            _ended=ended,
+            _started=ended - pl.col("duration_minutes").cast(pl.Int64) * 60,
+        )
+        .sort("_started", "stream_id")
+        .with_columns(
+            started_at=pl.col("viewed_at") - pl.duration(minutes=pl.col("duration_minutes")),
+            # the latest end of everything of the user's that started before, which a view
+            # nested in a longer one is measured against rather than just the view before it
+            _previous_end=pl.col("_ended").cum_max().shift(1).over("_user"),
+        )
+        .with_columns(
+            overlap_minutes=(
+                (pl.col("_previous_end") - pl.col("_started")).clip(0, None).fill_null(0) // 60
+            ).clip(None, pl.col("duration_minutes").cast(pl.Int64)),
+            _new_session=first | (pl.col("_started") - pl.col("_previous_end") > gap * 60),
+        )
+        .with_columns(
+            _new_run=(
+                pl.col("_new_session")
+                | ~episode
+                | ~episode.shift(1)
+                | pl.col("grandparent_title").ne_missing(pl.col("grandparent_title").shift(1))
+            ),
+        )
+        .with_columns(
+            concurrent=pl.col("overlap_minutes") >= concurrent,
+            counted_minutes=pl.col("duration_minutes").cast(pl.Int64) - pl.col("overlap_minutes"),
+            # flagged sorted, which the tables' group bys take a faster path for
+            session_id=pl.col("_new_session").cum_sum().set_sorted(),
+            run_id=pl.col("_new_run").cum_sum().set_sorted(),
+            # runs are contiguous, so their lengths come from fills rather than a group by
+            _run_length=pl.when(pl.col("_new_run").shift(-1).fill_null(True))
+            .then(row - pl.when(pl.col("_new_run")).then(row).forward_fill() + 1)
+            .backward_fill(),
+        )
+        .with_columns(binge=episode & (pl.col("_run_length") >= binge))
+        .drop("_user", "_ended", "_started", "_previous_end", "_new_session", "_new_run", "_run_length")
+    )
+
+
+def session_table(sessionized) -> pl.LazyFrame:
+    """One row per session: its user, span, views, devices and minutes with and without overlaps."""
+    # counting each session's first view from every device beats `n_unique` per session
+    device = pl.col("device_name").cast(pl.Categorical).to_physical().cast(pl.Int64)
+    new_device = (pl.col("session_id").cast(pl.Int64) * 2**32 + device).is_first_distinct()
+    return (
+        sessionized.lazy()
+        .with_columns(_new_device=new_device)
+        .group_by("session_id")
+        .agg(
+            pl.col("user").first(),
+            pl.col("started_at").min().alias("started"),
+            pl.col("viewed_at").max().alias("ended"),
+            pl.count().alias("views"),
+            pl.col("_new_device").sum().alias("devices"),
+            pl.col("concurrent").sum().alias("concurrent_views"),
+            pl.col("duration_minutes").cast(pl.Int64).sum(),
+            pl.col("counted_minutes").sum(),
+        )
+    )
+
+
+def binge_table(sessionized) -> pl.LazyFrame:
+    """One row per binge: its user, show, session, span and episodes."""
+    return (
+        sessionized.lazy()
+        .filter(pl.col("binge"))
+        .group_by("run_id")
+        .agg(
+            pl.col("user").first(),
+            pl.col("grandparent_title").first(),
+            pl.col("session_id").first(),
+            pl.col("started_at").min().alias("started"),
+            pl.col("viewed_at").max().alias("ended"),
+            pl.count().alias("episodes"),
+            pl.col("counted_minutes").sum(),
+        )
+    )
+
+
+def sync_sessions(views, stamp, path=SESSIONS) -> dict[str, pl.LazyFrame]:
+    """
+    The session tables of `views` (`views`, `sessions` and `binges`, see `sessionize`)
+    kept as parquet at `path`, recomputed only when `stamp` (e.g. the stream store's) changes.
+    """
+    meta = session_meta(path)
+    if meta.get("stamp") != stamp or meta.get("version") != VERSION:
+        sessionized = sessionize(views).collect()
+        sessions, binges = pl.collect_all([session_table(sessionized), binge_table(sessionized)])
+        tables = {"views": sessionized, "sessions": sessions, "binges": binges}
+
+        def write(tmp):
+            for name, df in tables.items():
+                df.write_parquet(tmp / f"{name}.parquet", statistics=True)
+            meta = {"stamp": stamp, "version": VERSION, **{name: df.height for name, df in tables.items()}}
+            (tmp / "sessions.json").write_text(json.dumps(meta))
+
+        swap_directory(path, write)
+    return scan_sessions(path)
+
+
+def session_meta(path=SESSIONS) -> dict:
+    try:
+        return json.loads((path / "sessions.json").read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def scan_sessions(path=SESSIONS) -> dict[str, pl.LazyFrame]:
+    return {
+        name: pl.scan_parquet(path / f"{name}.parquet").with_columns(pl.col(pl.Categorical).cast(LEXICAL))
+        for name in ("views", "sessions", "binges")
+    }
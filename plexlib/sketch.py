@@ -0,0 +1,143 @@
+# stdlib
+import json
+import heapq
+
+# 3rd party
+import polars as pl
+
+# local
+from . import OUTPUT
+from .files import atomic_write_text
+
+SKETCHES = OUTPUT / "sketches"
+CAPACITY = 1_000
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters of a weighted stream, in at most `capacity` counters.
+
+    Every counter holds `[count, error]`: the key's true weight is between `count - error`
+    and `count`, and `error` never exceeds `total / capacity`. Two sketches merge into one
+    with the same guarantee (Agarwal et al., "Mergeable Summaries"), so they can be built
+    per source and combined later.
+    """
+
+    def __init__(self, capacity=CAPACITY, counters=None, total=0):
+        self.capacity = capacity
+        self.counters = {} if counters is None else counters
+        self.total = total
+
+    def __len__(self):
+        return len(self.counters)
+
+    def floor(self):
+        """Upper bound of the weight of any key without a counter."""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def update(self, key, weight=1):
+        self.total += weight
+        if key in self.counters:
+            self.counters[key][0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = [weight, 0]
+        else:
+            smallest = min(self.counters, key=lambda k: self.counters[k][0])
+            count, _ = self.counters.pop(smallest)
+            self.counters[key] = [count + weight, count]
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """A new sketch summarizing both streams."""
+        floors = self.floor(), other.floor()
+        merged = {}
+        for key in self.counters.keys() | other.counters.keys():
+            a = self.counters.get(key, [floors[0], floors[0]])
+            b = other.counters.get(key, [floors[1], floors[1]])
+            merged[key] = [a[0] + b[0], a[1] + b[1]]
+        capacity = max(self.capacity, other.capacity)
+        kept = heapq.nlargest(capacity, merged.items(), key=lambda item: item[1][0])
+        return SpaceSaving(capacity, dict(kept), self.total + other.total)
+
+    def top(self, k) -> list[tuple]:
+        """The `k` heaviest `(key, count, error)`, heaviest first."""
+        return [
+            (key, count, error)
+            for key, (count, error) in heapq.nlargest(k, self.counters.items(), key=lambda item: item[1][0])
+        ]
+
+    @classmethod
+    def from_counts(cls, counts, capacity=CAPACITY) -> "SpaceSaving":
+        """A sketch of exact `{key: weight}` totals, keeping the heaviest `capacity`."""
+        sketch = cls(capacity, total=sum(counts.values()))
+        kept = heapq.nlargest(capacity, counts.items(), key=lambda item: item[1])
+        # exact, and anything dropped weighs at most the lightest kept (`floor`)
+        sketch.counters = {key: [weight, 0] for key, weight in kept}
+        return sketch
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "total": self.total, "counters": list(self.counters.items())}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["capacity"], {key: counter for key, counter in d["counters"]}, d["total"])
+
+
+# leaderboard name -> the column the exact question groups on
+LEADERBOARDS = {"Top show": "grandparent_title", "Top movie": "title", "Top star": "star"}
+
+
+def read_sketches(source, path=SKETCHES) -> dict[str, SpaceSaving]:
+    """The sketches kept for `source` (a source DB's stem), empty if there are none."""
+    try:
+        sketches = json.loads((path / f"{source}.json").read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {name: SpaceSaving.from_dict(d) for name, d in sketches.items()}
+
+
+def add_sketches(source, sketches, path=SKETCHES):
+    """Merge `sketches` into the ones kept for `source`."""
+    kept = read_sketches(source, path=path)
+    for name, sketch in sketches.items():
+        kept[name] = kept[name].merge(sketch) if name in kept else sketch
+    atomic_write_text(path / f"{source}.json", json.dumps({name: sketch.to_dict() for name, sketch in kept.items()}))
+
+
+def clear_sketches(path=SKETCHES):
+    for sketchfile in path.glob("*.json"):
+        sketchfile.unlink()
+
+
+def leaderboards(k=5, year=None, path=SKETCHES) -> dict[str, pl.DataFrame]:
+    """
+    Approximate "Top show", "Top movie" and "Top star" from the merged sketches of every
+    source, the `k` heaviest each, with the most hours each one could be overcounted by.
+    Sketches are kept per year of the views, only those of `year` are merged if given.
+    """
+    merged = {}
+    for sketchfile in sorted(path.glob("*.json")):
+        for key, sketch in read_sketches(sketchfile.stem, path=path).items():
+            sketch_year, _, name = key.rpartition(":")
+            if year is not None and sketch_year != str(year):
+                continue
+            merged[name] = merged[name].merge(sketch) if name in merged else sketch
+
+    boards = {}
+    for name, column in LEADERBOARDS.items():
+        top = merged[name].top(k) if name in merged else []
+        boards[name] = (
+            pl.DataFrame(
+                top,
+                schema={column: pl.Utf8, "duration_minutes": pl.Int64, "error_minutes": pl.Int64},
+                orient="row",
+            )
+            .select(
+                column,
+                (pl.col("duration_minutes") / 60).alias("duration_hours"),
+                (pl.col("error_minutes") / 60).alias("max_error_hours"),
+            )
+            .sort("duration_hours")
+        )
+    return boards
@@ -0,0 +1,481 @@
+# stdlib
+import time
+import hashlib
+import datetime as dt
+from collections import defaultdict
+
+# 3rd party
+import polars as pl
+
+# local
+from plexlib.quantiles import quantile_sketches
+from plexlib.rollup import with_view_time
+from plexlib.tags import encode_tags
+
+# the year the questions are about, views from START up to (not including) END
+START = dt.date(2023, 1, 1)
+END = dt.date(2024, 1, 1)
+TOP_N = 3
+
+# every column a question reads, the shared base is projected down to these
+BASE_COLUMNS = [
+    "user",
+    "day",
+    "hour",
+    "weekday",
+    "media_type",
+    "title",
+    "grandparent_title",
+    "duration_minutes",
+    "views",
+    "rating",
+    "tags_genre",
+    "tags_star",
+    "tags_director",
+    "tags_country",
+]
+
+TAG_COLUMNS = {
+    "tags_genre": "genre",
+    "tags_star": "star",
+    "tags_director": "director",
+    "tags_country": "country",
+}
+
+
+QUESTIONS = {}
+
+
+class Question:
+    """A named stat, built as a LazyFrame on top of the shared base frame."""
+
+    def __init__(self, name, scope, build, tables=()):
+        self.name = name
+        self.scope = scope
+        self.build = build
+        self.tables = tables
+
+    def __repr__(self):
+        return f"Question({self.name!r}, scope={self.scope!r})"
+
+
+def question(name, scope, tables=()):
+    """
+    Register `build(base: pl.LazyFrame, *tables) -> pl.LazyFrame` under `name` for `group`,
+    `user` or `owner` stats. `tables` names the auxiliary frames (e.g. tag bridges) it also
+    needs. Owner stats are built on the media table instead of the stream base.
+    """
+
+    def register(build):
+        QUESTIONS[name] = Question(name, scope, build, tables=tables)
+        return build
+
+    return register
+
+
+def questions(scope=None, names=None) -> list[Question]:
+    """Registered questions, in registration order, optionally narrowed by scope and name."""
+    if names is not None:
+        unknown = set(names) - set(QUESTIONS)
+        if unknown:
+            raise KeyError(f"Unknown questions: {sorted(unknown)}")
+    return [
+        q
+        for q in QUESTIONS.values()
+        if (scope is None or q.scope == scope) and (names is None or q.name in names)
+    ]
+
+
+def shared_base(df, user=None, until=END) -> tuple[pl.LazyFrame, dict[str, pl.LazyFrame]]:
+    """
+    The filtered, projected frame every question starts from, materialized once, with its
+    tag columns swapped for integer ids, and the tag bridges those ids join against.
+
+    `df` is either raw views or their rollup (`plexlib.rollup.rollup_base`), questions only
+    sum `duration_minutes` and `views` so both give the same answers. Views from `START`
+    up to `until` are kept, all of them since `START` with `until=None`.
+    """
+    base, bridges = encode_tags(_since_start(df, user=user, until=until).select(BASE_COLUMNS).collect(), TAG_COLUMNS)
+
+    tables = {}
+    for column, (bridge, tags) in bridges.items():
+        tables[f"{column}_bridge"] = bridge.lazy()
+        tables[f"{column}_tags"] = tags.lazy()
+    return base.lazy(), tables
+
+
+def question_base(df, scope=None, user=None, tables=None, until=END) -> tuple[pl.LazyFrame, dict[str, pl.LazyFrame]]:
+    """
+    What the questions of `scope` are built on, see `shared_base`, along with `tables`
+    (e.g. the session tables from `plexlib.sessions.sync_sessions`) narrowed down the same way.
+    """
+    if scope == "owner":
+        return df.lazy(), {}
+    base, bridges = shared_base(df, user=user, until=until)
+    tables = {name: _ended_since_start(table, user=user, until=until) for name, table in (tables or {}).items()}
+    return base, {**bridges, **tables}
+
+
+def _since_start(df, user=None, until=END) -> pl.LazyFrame:
+    base = df.lazy()
+    if "viewed_at" in base.columns:
+        base = with_view_time(base)
+    base = base.filter(pl.col("day") >= START)
+    if until is not None:
+        base = base.filter(pl.col("day") < until)
+    if user is not None:
+        base = base.filter(pl.col("user") == user)
+    return base
+
+
+def _ended_since_start(table, user=None, until=END) -> pl.LazyFrame:
+    table = table.lazy().filter(pl.col("ended").dt.date() >= START)
+    if until is not None:
+        table = table.filter(pl.col("ended").dt.date() < until)
+    if user is not None:
+        table = table.filter(pl.col("user") == user)
+    return table
+
+
+def _answerable(selected, tables, names=None) -> list[Question]:
+    """
+    `selected` without the questions needing tables that weren't given, unless they were
+    asked for by name.
+    """
+    missing = {q.name: sorted(set(q.tables) - set(tables)) for q in selected if set(q.tables) - set(tables)}
+    if names is not None and missing:
+        raise KeyError(f"Questions missing tables: {missing}")
+    return [q for q in selected if q.name not in missing]
+
+
+def run_questions(df, scope=None, names=None, user=None, tables=None, until=END) -> dict[str, pl.DataFrame]:
+    """
+    Answer every selected question off a single scan of `df`, executed together. Questions
+    on tables other than the tag bridges (e.g. `sessions`) need them passed in `tables`.
+    Only views from `START` up to `until` count, see `shared_base`.
+    """
+    base, tables = question_base(df, scope=scope, user=user, tables=tables, until=until)
+    selected = _answerable(questions(scope=scope, names=names), tables, names=names)
+    results = pl.collect_all([q.build(base, *(tables[t] for t in q.tables)) for q in selected])
+    return {q.name: X for q, X in zip(selected, results)}
+
+
+def profile_questions(df, scope=None, names=None, user=None, tables=None, until=END) -> list[dict]:
+    """
+    Run every selected question on its own under polars' profiler, slowest first.
+
+    Each report has the question's optimized plan, the time spent per plan node (in
+    microseconds), its wall time and the size of its result. Building the shared base is
+    reported first, as it is paid once for all of them.
+    """
+    start = time.perf_counter()
+    base, tables = question_base(df, scope=scope, user=user, tables=tables, until=until)
+    selected = _answerable(questions(scope=scope, names=names), tables, names=names)
+    shared = {"question": "(shared base)", "scope": scope, "seconds": time.perf_counter() - start}
+
+    reports = []
+    for q in selected:
+        X = q.build(base, *(tables[t] for t in q.tables))
+        plan = X.explain()
+        start = time.perf_counter()
+        result, nodes = X.profile()
+        reports.append(
+            {
+                "question": q.name,
+                "scope": q.scope,
+                "seconds": time.perf_counter() - start,
+                "rows": result.height,
+                "bytes": result.estimated_size(),
+                "slowest_node": nodes.sort(pl.col("end") - pl.col("start")).get_column("node")[-1],
+                "plan": plan,
+                "nodes": nodes.to_dicts(),
+            }
+        )
+    return [shared, *sorted(reports, key=lambda report: report["seconds"], reverse=True)]
+
+
+def user_digests(df, tables=None, until=END) -> dict[str, str]:
+    """
+    A digest per user of everything the user questions read of them: their rows of the
+    shared base and of `tables`, narrowed like `run_questions` does. It doesn't depend on
+    the order of the rows, so it only changes when the rows do.
+    """
+    frames = [
+        _since_start(df, until=until).select(BASE_COLUMNS),
+        *(_ended_since_start(t, until=until) for t in (tables or {}).values()),
+    ]
+    parts = defaultdict(list)
+    for i, X in enumerate(pl.collect_all([_user_hashes(frame) for frame in frames])):
+        for user, rows, total in X.iter_rows():
+            parts[user].append(f"{i}:{rows}:{total}")
+    return {user: hashlib.md5("|".join(p).encode()).hexdigest() for user, p in parts.items()}
+
+
+def _user_hashes(frame) -> pl.LazyFrame:
+    # categoricals hash by their codes, which differ between scans
+    frame = frame.with_columns(pl.col(pl.Categorical).cast(pl.Utf8))
+    return (
+        frame.with_columns(
+            # the top half of each row's hash, so summing millions of them can't overflow
+            _hash=(pl.struct(pl.all()).hash() // 2**32).cast(pl.Int64)
+        )
+        .group_by("user")
+        .agg(pl.count().alias("rows"), pl.col("_hash").sum())
+    )
+
+
+def stats_by_tag(
+    df: pl.LazyFrame, column: str, bridge: pl.LazyFrame, tags: pl.LazyFrame, by: list[str] = None
+) -> pl.LazyFrame:
+    """
+    Watch time per tag of `column`, rolled up on the integer ids from `encode_tags`: minutes
+    are summed per distinct tag string first and only then fanned out through the bridge.
+    """
+    if by is None:
+        by = []
+    newcol = column.split("_")[-1]
+    value_id = f"{column}_id"
+    X = (
+        df.filter((pl.col(value_id).is_not_null()) & (pl.col("media_type") != "TV Series"))
+        .group_by(*by, value_id)
+        .agg(pl.col("duration_minutes").sum())
+        .join(bridge, left_on=value_id, right_on="value_id")
+        .group_by(*by, "tag_id")
+        .agg(pl.col("duration_minutes").sum())
+        .join(tags, on="tag_id")
+        .select(*by, pl.col("tag").alias(newcol), (pl.col("duration_minutes") / 60).alias("duration_hours"))
+        .sort(*by, "duration_hours")
+    )
+    return X
+
+
+@question("Top show", scope="group")
+def top_show(df):
+    return (
+        df.filter(pl.col("media_type") == "TV Series")
+        .group_by("grandparent_title")
+        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
+        .sort("duration_hours")
+        .filter((pl.col("duration_hours").rank(descending=True)) <= 5)
+    )
+
+
+@question("Top movie", scope="group")
+def top_movie(df):
+    return (
+        df.filter(pl.col("media_type") != "TV Series")
+        .group_by("title")
+        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
+        .sort("duration_hours")
+        .filter((pl.col("duration_hours").rank(descending=True)) <= 5)
+    )
+
+
+@question("Total watch time", scope="user")
+def total_watch_time(df):
+    return (
+        df.group_by("user")
+        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
+        .with_columns(duration_days=pl.col("duration_hours") / 24)
+        .sort("duration_hours")
+    )
+
+
+@question("Top show by user", scope="user")
+def top_show_by_user(df):
+    return (
+        df.filter(pl.col("media_type") == "TV Series")
+        .group_by("user", "grandparent_title")
+        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
+        .sort("user", "duration_hours")
+        .filter((pl.col("duration_hours").rank(descending=True).over("user")) <= TOP_N)
+    )
+
+
+@question("Top movie by user", scope="user")
+def top_movie_by_user(df):
+    return (
+        df.filter(pl.col("media_type") != "TV Series")
+        .group_by("user", "title")
+        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
+        .sort("user", "duration_hours")
+        .filter((pl.col("duration_hours").rank(descending=True).over("user")) <= TOP_N)
+    )
+
+
+def _register_tag_questions(column, label):
+    tables = (f"{column}_bridge", f"{column}_tags")
+
+    @question(f"Top {label}", scope="group", tables=tables)
+    def top_tag(df, bridge, tags):
+        return stats_by_tag(df, column, bridge, tags).filter((pl.col("duration_hours").rank(descending=True)) <= 5)
+
+    @question(f"Top {label} by user", scope="user", tables=tables)
+    def top_tag_by_user(df, bridge, tags):
+        return stats_by_tag(df, column, bridge, tags, by=["user"]).filter(
+            (pl.col("duration_hours").rank(descending=True).over("user")) <= TOP_N
+        )
+
+
+for _column, _label in TAG_COLUMNS.items():
+    _register_tag_questions(_column, _label)
+
+
+@question("Watched most past 1am MST", scope="group")
+def sleepy_time(df):
+    return (
+        df.with_columns(sleepy_time=pl.col("hour").is_between(1, 6, closed="both"))
+        .filter("sleepy_time")
+        .group_by("user")
+        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
+        .sort("duration_hours")
+        .filter((pl.col("duration_hours").rank(descending=True)) <= 5)
+    )
+
+
+@question("Watched most during work hours on weekdays", scope="group")
+def work_hours(df):
+    return (
+        df.with_columns(
+            during_work_hours=(
+                pl.col("hour").is_between(8, 17, closed="both")
+                & pl.col("weekday").is_between(1, 5, closed="both")
+            )
+        )
+        .filter("during_work_hours")
+        .group_by("user")
+        .agg((pl.col("duration_minutes").sum() / 60).alias("duration_hours"))
+        .sort("duration_hours")
+        .filter((pl.col("duration_hours").rank(descending=True)) <= 5)
+        .with_columns(workdays_wasted=pl.col("duration_hours") / 8)
+    )
+
+
+@question("Garbagemeter", scope="user")
+def garbagemeter(df):
+    # every rating with how many views it has, in order, so the rating at a quantile's rank
+    # (what interpolation="nearest" picks) is the first whose running count passes it
+    ratings = (
+        df.filter(pl.col("media_type") != "TV Series")
+        .group_by("user", "rating")
+        .agg(pl.col("views").cast(pl.Int64).sum())
+        # unrated views don't count, but their users still get a (null) row
+        .with_columns(pl.when(pl.col("rating").is_not_null()).then(pl.col("views")).otherwise(0))
+        .sort("user", "rating")
+        .with_columns(
+            through=pl.col("views").cum_sum().over("user"),
+            rank=pl.col("views").sum().over("user") - 1,
+        )
+    )
+    return (
+        ratings.group_by("user")
+        .agg(
+            pl.col("rating")
+            .filter(pl.col("through") > (pl.col("rank") * (i / 10)).round())
+            .first()
+            .alias(f"Rating Quantile @ {i/10:0.0%}")
+            for i in range(0, 11, 1)
+        )
+        .sort("Rating Quantile @ 0%")
+    )
+
+
+@question("Top binged show", scope="group", tables=("binges",))
+def top_binged_show(df, binges):
+    return (
+        binges.group_by("grandparent_title")
+        .agg(
+            pl.count().alias("binges"),
+            pl.col("episodes").sum(),
+            (pl.col("counted_minutes").sum() / 60).alias("duration_hours"),
+        )
+        .sort("episodes")
+        .filter((pl.col("episodes").rank(descending=True)) <= 5)
+    )
+
+
+@question("Longest binge by user", scope="user", tables=("binges",))
+def longest_binge_by_user(df, binges):
+    return (
+        binges.sort("user", "episodes", "counted_minutes")
+        .group_by("user", maintain_order=True)
+        .last()
+        .select(
+            "user",
+            "grandparent_title",
+            "started",
+            "episodes",
+            (pl.col("counted_minutes") / 60).alias("duration_hours"),
+        )
+    )
+
+
+@question("Sessions by user", scope="user", tables=("sessions",))
+def sessions_by_user(df, sessions):
+    return (
+        sessions.group_by("user")
+        .agg(
+            pl.count().alias("sessions"),
+            (pl.col("counted_minutes").mean() / 60).alias("mean_session_hours"),
+            (pl.col("counted_minutes").max() / 60).alias("longest_session_hours"),
+            pl.col("concurrent_views").sum(),
+            # time that played alongside other views, summing plain durations counts it twice
+            ((pl.col("duration_minutes") - pl.col("counted_minutes")).sum() / 60).alias("double_counted_hours"),
+        )
+        .sort("user")
+    )
+
+
+def garbagemeter_sketch(df, user=None, until=END) -> pl.DataFrame:
+    """
+    The Garbagemeter off one t-digest of movie ratings per user (see `plexlib.quantiles`)
+    instead of eleven exact quantiles per user, approximate once a user has rated more
+    distinct values than the digest keeps.
+    """
+    movies = _since_start(df, user=user, until=until).filter(pl.col("media_type") != "TV Series")
+    digests = quantile_sketches(movies, by="user", value="rating", weight="views")
+    return pl.DataFrame(
+        [
+            {"user": name, **{f"Rating Quantile @ {i/10:0.0%}": digest.quantile(i / 10) for i in range(0, 11, 1)}}
+            for (name,), digest in digests.items()
+        ],
+        schema={"user": pl.Utf8, **{f"Rating Quantile @ {i/10:0.0%}": pl.Float64 for i in range(0, 11, 1)}},
+    ).sort("Rating Quantile @ 0%")
+
+
+def _added_name():
+    return (
+        pl.when(pl.col("parent_title").is_null() | (pl.col("parent_title") == ""))
+        .then(pl.col("title"))
+        .otherwise(pl.col("parent_title"))
+        .alias("name")
+    )
+
+
+def _added_stats(df, by):
+    return (
+        df.group_by(by)
+        .agg(
+            pl.col("name").count().alias("# Added"),
+            pl.col("duration_minutes").sum(),
+            pl.col("rating").drop_nans().drop_nulls().mean(),
+            pl.col("audience_rating").drop_nans().drop_nulls().mean(),
+        )
+        .with_columns((pl.col("duration_minutes") / 60).alias("hours"))
+    )
+
+
+@question("Media added", scope="owner")
+def media_added(df):
+    return _added_stats(df.with_columns(_added_name()), ["sourcedb", "media_type"]).sort("sourcedb", "media_type")
+
+
+@question("Media added by genre", scope="owner")
+def media_added_by_genre(df):
+    return _added_stats(
+        df.with_columns(
+            _added_name(),
+            pl.col("tags_genre").replace("", "UNK").str.split("|").list.first().alias("genre"),
+        ),
+        ["sourcedb", "media_type", "genre"],
+    ).sort("sourcedb", "media_type", "audience_rating")
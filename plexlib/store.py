@@ -0,0 +1,113 @@
+# stdlib
+import json
+import datetime as dt
+from urllib.parse import quote, unquote
+
+# 3rd party
+import polars as pl
+
+# local
+from . import OUTPUT
+from .compact import LEXICAL
+from .files import swap_directory
+
+STORE = OUTPUT / "streams"
+ROW_GROUP_SIZE = 64_000
+
+
+def sync_store(df, stamp, path=STORE, by_user=False):
+    """
+    Make sure the store at `path` holds `df`, rewriting it unless it was last written from
+    the same `stamp` (anything identifying the data, e.g. combined.db's size and mtime) and
+    schema.
+    """
+    meta = store_meta(path)
+    if meta.get("stamp") == stamp and meta.get("by_user") == by_user and meta.get("schema") == _schema(df):
+        return
+    write_store(df, stamp, path=path, by_user=by_user)
+
+
+def store_meta(path=STORE) -> dict:
+    try:
+        return json.loads((path / "store.json").read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_store(df, stamp, path=STORE, by_user=False):
+    """
+    Write every view of `df` as Parquet (with statistics) under `path`, one file per month
+    in `year=YYYY/month=MM/`, and with `by_user` one per user and month below that, in
+    `user=<quoted name>/`. The new store is built next to the old one and swapped in whole.
+    """
+    # not `year`, the base frame already has one (the media's)
+    by = ["view_year", "view_month", "user"] if by_user else ["view_year", "view_month"]
+    df = (
+        df.lazy()
+        # undated views can't pass any date filter the stats use
+        .filter(pl.col("viewed_at").is_not_null())
+        .with_columns(view_year=pl.col("viewed_at").dt.year(), view_month=pl.col("viewed_at").dt.month())
+        .collect()
+    )
+
+    def write(tmp):
+        files = []
+        for key, partition in df.partition_by(by, as_dict=True).items():
+            directory = tmp / f"year={key[0]:04d}" / f"month={key[1]:02d}"
+            if by_user:
+                directory /= f"user={quote(str(key[2]), safe='')}"
+            directory.mkdir(parents=True, exist_ok=True)
+            partition.drop("view_year", "view_month").write_parquet(
+                directory / "part.parquet", statistics=True, row_group_size=ROW_GROUP_SIZE
+            )
+            files.append(str((directory / "part.parquet").relative_to(tmp)))
+        # an empty partition keeps the schema around for when nothing else matches
+        df.clear().drop("view_year", "view_month").write_parquet(tmp / "empty.parquet")
+        meta = {
+            "stamp": stamp,
+            "by_user": by_user,
+            "schema": _schema(df.drop("view_year", "view_month")),
+            "rows": df.height,
+            "files": sorted(files),
+        }
+        (tmp / "store.json").write_text(json.dumps(meta))
+
+    swap_directory(path, write)
+
+
+def _schema(df):
+    return {column: str(dtype) for column, dtype in df.schema.items()}
+
+
+def scan_store(since: dt.date = None, until: dt.date = None, user=None, path=STORE) -> pl.LazyFrame:
+    """
+    Lazily scan the views in the store, optionally from `since` and before `until` and for a
+    single `user`. Only the files of the months (and users) that can match are scanned, and
+    row group statistics skip the rest of the months at either end.
+    """
+    meta = store_meta(path)
+    if not meta:
+        raise FileNotFoundError(path / "store.json")
+
+    files = []
+    for file in meta["files"]:
+        partition = dict(part.split("=", 1) for part in file.split("/")[:-1])
+        month = dt.date(int(partition["year"]), int(partition["month"]), 1)
+        if since is not None and month < since.replace(day=1):
+            continue
+        if until is not None and month >= until:
+            continue
+        if user is not None and "user" in partition and unquote(partition["user"]) != user:
+            continue
+        files.append(str(path / file))
+
+    df = pl.scan_parquet(files or str(path / "empty.parquet"), hive_partitioning=False).with_columns(
+        pl.col(pl.Categorical).cast(LEXICAL)
+    )
+    if since is not None:
+        df = df.filter(pl.col("viewed_at") >= since)
+    if until is not None:
+        df = df.filter(pl.col("viewed_at") < until)
+    if user is not None:
+        df = df.filter(pl.col("user") == user)
+    return df
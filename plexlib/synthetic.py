@@ -0,0 +1,230 @@
+"""
+Fake Plex library DBs, with just the tables and columns `plexlib.data` reads from.
+
+Every server draws from one shared catalog of shows, films and people, so the same title
+shows up on several servers, sometimes with the small differences (punctuation, casing,
+whitespace, suffixes) that `combine_media` and `combine_accounts` exist to reconcile.
+"""
+
+# stdlib
+import random
+import sqlite3
+import pathlib
+import datetime as dt
+
+SCHEMA = """
+CREATE TABLE accounts (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE devices (id INTEGER PRIMARY KEY, name TEXT, platform TEXT);
+CREATE TABLE library_sections (id INTEGER PRIMARY KEY, name TEXT, section_type INTEGER);
+CREATE TABLE metadata_items (
+  id INTEGER PRIMARY KEY
+, parent_id INTEGER
+, library_section_id INTEGER
+, guid TEXT
+, metadata_type INTEGER
+, title TEXT
+, "index" INTEGER
+, studio TEXT
+, rating REAL
+, audience_rating REAL
+, content_rating TEXT
+, summary TEXT
+, year INTEGER
+, originally_available_at INTEGER
+, added_at INTEGER
+, deleted_at INTEGER
+, tags_genre TEXT
+, tags_director TEXT
+, tags_writer TEXT
+, tags_star TEXT
+, tags_country TEXT
+);
+CREATE TABLE media_items (
+  id INTEGER PRIMARY KEY
+, library_section_id INTEGER
+, metadata_item_id INTEGER
+, duration INTEGER
+);
+CREATE TABLE metadata_item_views (
+  id INTEGER PRIMARY KEY
+, account_id INTEGER
+, guid TEXT
+, metadata_type INTEGER
+, library_section_id INTEGER
+, device_id INTEGER
+, viewed_at INTEGER
+);
+CREATE INDEX index_metadata_items_on_guid ON metadata_items (guid);
+CREATE INDEX index_media_items_on_metadata_item_id ON media_items (metadata_item_id);
+"""
+
+FILM, SHOW, SEASON, EPISODE = 1, 2, 3, 4
+
+GENRES = ["Drama", "Comedy", "Action", "Horror", "Sci-Fi", "Animation", "Documentary", "Thriller", "Romance"]
+COUNTRIES = ["United States of America", "United Kingdom", "Japan", "France", "Canada", "South Korea"]
+PLATFORMS = ["Roku", "iOS", "Android", "Chrome", "Apple TV", "Plex for Windows"]
+RATINGS = ["G", "PG", "PG-13", "R", "TV-PG", "TV-14", "TV-MA"]
+WORDS = (
+    "the night last city dark blue house road star war love time lost river king queen ghost"
+    " empire secret summer winter fire iron silent wild black golden broken hidden final"
+).split()
+
+
+def catalog(shows=200, films=1_000, people=2_000, seed=0):
+    """The shared library every fake server picks from."""
+    r = random.Random(seed)
+    cast = [f"{r.choice(WORDS).title()} {r.choice(WORDS).title()}son {i}" for i in range(people)]
+
+    def title():
+        return " ".join(r.choice(WORDS) for _ in range(r.randint(1, 4))).title()
+
+    def tags():
+        return {
+            "studio": f"{title()} Pictures",
+            "rating": round(r.uniform(1, 10), 1),
+            "audience_rating": round(r.uniform(1, 10), 1),
+            "content_rating": r.choice(RATINGS),
+            "summary": " ".join(r.choice(WORDS) for _ in range(40)),
+            "year": r.randint(1950, 2023),
+            "tags_genre": "|".join(r.sample(GENRES, r.randint(1, 3))),
+            "tags_director": "|".join(r.sample(cast, r.randint(1, 2))),
+            "tags_writer": "|".join(r.sample(cast, r.randint(1, 3))),
+            "tags_star": "|".join(r.sample(cast, r.randint(3, 15))),
+            "tags_country": "|".join(r.sample(COUNTRIES, r.randint(1, 2))),
+        }
+
+    return {
+        "shows": [
+            {
+                "title": f"{title()} {i}",
+                **tags(),
+                "seasons": [
+                    [f"{title()} Part {e}" for e in range(1, r.randint(6, 24))]
+                    for _ in range(r.randint(1, 6))
+                ],
+            }
+            for i in range(shows)
+        ],
+        "films": [{"title": f"{title()} {i}", **tags()} for i in range(films)],
+    }
+
+
+def near_duplicate(title, r):
+    """The same title as another server might have it."""
+    return r.choice(
+        [
+            title,
+            title,
+            title,
+            title + ".",
+            title + "!",
+            title.lower(),
+            title.replace(" ", "  ", 1),
+            f"{title} (US)",
+        ]
+    )
+
+
+def write_plex_db(path, library, seed=0, coverage=0.7, views=50_000, accounts=20, devices=8, year=2023):
+    """
+    Write one fake Plex DB to `path` holding roughly `coverage` of `library`, watched
+    `views` times by `accounts` users over `year` and the year before it.
+    """
+    r = random.Random(seed)
+    path = pathlib.Path(path)
+    path.unlink(missing_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+
+    conn.executemany(
+        "INSERT INTO accounts VALUES (?, ?)",
+        [(i, near_duplicate(f"user{i}", r) if i > 1 else "owner") for i in range(1, accounts + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO devices VALUES (?, ?, ?)",
+        [(i, f"device {i}", r.choice(PLATFORMS)) for i in range(1, devices + 1)],
+    )
+    conn.executemany("INSERT INTO library_sections VALUES (?, ?, ?)", [(1, "Movies", 1), (2, "TV Shows", 2)])
+
+    items, media, leaves = [], [], []
+    start = int(dt.datetime(year - 1, 1, 1).timestamp())
+
+    def add(parent_id, section, metadata_type, index, title, meta, duration=None):
+        id_ = len(items) + 1
+        guid = f"plex://{metadata_type}/{seed}/{id_}"
+        deleted = start if r.random() < 0.01 else None
+        items.append(
+            (
+                id_,
+                parent_id,
+                section,
+                guid,
+                metadata_type,
+                title,
+                index,
+                meta["studio"],
+                meta["rating"],
+                meta["audience_rating"],
+                meta["content_rating"],
+                meta["summary"],
+                meta["year"],
+                int(dt.datetime(meta["year"], 1, 1).timestamp()),
+                start + r.randint(0, 730 * 86400),
+                deleted,
+                meta["tags_genre"],
+                meta["tags_director"],
+                meta["tags_writer"],
+                meta["tags_star"],
+                meta["tags_country"],
+            )
+        )
+        if duration is not None:
+            media.append((len(media) + 1, section, id_, duration))
+            leaves.append((guid, metadata_type, section))
+        return id_
+
+    for film in library["films"]:
+        if r.random() < coverage:
+            add(None, 1, FILM, None, near_duplicate(film["title"], r), film, r.randint(80, 180) * 60_000)
+
+    for show in library["shows"]:
+        if r.random() >= coverage:
+            continue
+        show_id = add(None, 2, SHOW, None, near_duplicate(show["title"], r), show)
+        for season_index, episodes in enumerate(show["seasons"], 1):
+            season_id = add(show_id, 2, SEASON, season_index, f"Season {season_index}", show)
+            for index, episode in enumerate(episodes, 1):
+                add(
+                    season_id, 2, EPISODE, index, near_duplicate(episode, r), show, r.randint(20, 60) * 60_000
+                )
+
+    conn.executemany(f"INSERT INTO metadata_items VALUES ({', '.join('?' * 21)})", items)
+    conn.executemany("INSERT INTO media_items VALUES (?, ?, ?, ?)", media)
+
+    # popularity is heavily skewed, like real libraries
+    weights = [1 / (rank + 1) for rank in range(len(leaves))]
+    r.shuffle(weights)
+    watched = r.choices(leaves, weights=weights, k=views) if leaves else []
+    # view ids follow time, like an append-only history
+    times = sorted(start + r.randint(0, 730 * 86400) for _ in watched)
+    conn.executemany(
+        "INSERT INTO metadata_item_views VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (i, r.randint(1, accounts), guid, metadata_type, section, r.randint(1, devices), viewed_at)
+            for i, ((guid, metadata_type, section), viewed_at) in enumerate(zip(watched, times), 1)
+        ),
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def write_plex_dbs(directory, servers=3, shows=200, films=1_000, views=50_000, accounts=20, seed=0):
+    """Write `servers` fake Plex DBs (`server<n>.db`) sharing one catalog into `directory`."""
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    library = catalog(shows=shows, films=films, seed=seed)
+    return [
+        write_plex_db(directory / f"server{n}.db", library, seed=seed + n, views=views, accounts=accounts)
+        for n in range(servers)
+    ]
@@ -0,0 +1,50 @@
+# stdlib
+import hashlib
+
+# 3rd party
+import polars as pl
+
+# local
+from plexlib.cache import CACHE_MAX_BYTES, evict, read_entry, write_entry
+
+
+def tag_bridge(values: pl.Series, max_bytes=CACHE_MAX_BYTES) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Split distinct pipe-delimited tag strings into a dictionary-encoded bridge.
+
+    Returns `(bridge, tags)`: `bridge` maps the position of each string in `values` (its
+    `value_id`) to one `tag_id` per tag it lists, duplicates included, and `tags` maps
+    `tag_id` back to the tag. Both are kept in the query cache, keyed on `values`, and
+    count towards its `max_bytes` like any other entry.
+    """
+    key = "tags_" + hashlib.sha256("\x1f".join(values.to_list()).encode()).hexdigest()[:32]
+    bridge, tags = read_entry(f"{key}_bridge"), read_entry(f"{key}_tags")
+    if bridge is not None and tags is not None:
+        return bridge, tags
+
+    exploded = (
+        values.to_frame("tag")
+        .with_row_count("value_id")
+        .with_columns(pl.col("tag").str.split("|"))
+        .explode("tag")
+    )
+    tags = exploded.select(pl.col("tag").unique(maintain_order=True)).with_row_count("tag_id")
+    bridge = exploded.join(tags, on="tag").select("value_id", "tag_id")
+
+    write_entry(f"{key}_bridge", bridge, function="tag_bridge", source=values.name)
+    write_entry(f"{key}_tags", tags, function="tag_bridge", source=values.name)
+    evict(max_bytes)
+    return bridge, tags
+
+
+def encode_tags(df: pl.DataFrame, columns) -> tuple[pl.DataFrame, dict[str, tuple[pl.DataFrame, pl.DataFrame]]]:
+    """
+    Replace every tag column of `df` by `<column>_id`, an integer id of its (distinct) value,
+    and return the bridges (see `tag_bridge`) that id joins against.
+    """
+    bridges = {}
+    for column in columns:
+        encoded = df.get_column(column).cast(pl.Categorical)
+        bridges[column] = tag_bridge(encoded.cat.get_categories().rename(column))
+        df = df.with_columns(encoded.to_physical().alias(f"{column}_id")).drop(column)
+    return df, bridges
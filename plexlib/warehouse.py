@@ -0,0 +1,34 @@
+# stdlib
+import os
+
+# 3rd party
+import polars as pl
+
+# local
+from .cache import with_cache
+from .compact import compact
+
+BASE_QUERY = """
+    SELECT *
+    FROM plex_wrapped.output.plex_wrapped_2023_base
+"""
+
+
+@with_cache(source="snowflake", lazy=True, normalize=compact)
+def load_dataset(query):
+    # the connector takes longer to import than everything else put together, and a
+    # cache hit doesn't need it
+    import snowflake.connector
+
+    account = os.environ["SNOWFLAKE_ACCOUNT"]
+    user = os.environ["SNOWFLAKE_USER"]
+    passwd = os.environ["SNOWFLAKE_PASSWORD"]
+
+    conn = snowflake.connector.connect(account=account, user=user, password=passwd)
+
+    df = pl.read_database(
+        query=query,
+        connection=conn,
+    )
+
+    return df
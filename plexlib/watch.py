@@ -0,0 +1,94 @@
+# stdlib
+import json
+import time
+import datetime as dt
+
+# 3rd party
+import polars as pl
+
+# local
+from . import OUTPUT
+from .data import build_database
+from .files import atomic_write_text
+from .local import SOURCE, load_local_views, local_view_labels
+from .rollup import ROLLUP, append_rollup, rollup_meta
+from .stats import run_questions
+
+LIVE = OUTPUT / "live.json"
+
+# what the snapshot answers, sums the rollup keeps up to date
+GROUP_QUESTIONS = ["Top show", "Top movie"]
+USER_QUESTIONS = ["Total watch time", "Top show by user", "Top movie by user"]
+
+
+def watch(interval=60, jobs=1, polls=None, path=LIVE, rollup_path=ROLLUP):
+    """
+    Follow the Plex DBs while Plex runs: every `interval` seconds, append whatever they
+    gained to combined.db (read without `immutable`, up to the ids they had when polled),
+    and update the snapshot at `path` from just the new views. Stops after `polls` polls,
+    if given.
+    """
+    done = 0
+    while True:
+        build_database(True, jobs=jobs, immutable=False)
+        snapshot = update_snapshot(path, rollup_path=rollup_path)
+        print(f"{snapshot['updated_at']}: {snapshot['views']} views through stream {snapshot['watermark']}")
+        done += 1
+        if polls is not None and done >= polls:
+            return snapshot
+        time.sleep(interval)
+
+
+def update_snapshot(path=LIVE, rollup_path=ROLLUP) -> dict:
+    """
+    Merge the views past the rollup's watermark into it and rewrite the snapshot at `path`.
+
+    Group questions are answered again off the rollup, user questions only for the users
+    that have new views, the others keep their rows from the last snapshot. Unlike the
+    batch stats they count every view since the stats start, up to now. If combined.db
+    no longer holds the views rolled up as they were (it was rebuilt, a build relinked
+    them, or they came from snowflake) everything starts over.
+    """
+    meta = rollup_meta(rollup_path)
+    watermark = meta.get("watermark")
+    if meta.get("source") != SOURCE or (
+        watermark is not None and local_view_labels(watermark) != (meta["views"], meta.get("labels"))
+    ):
+        meta, watermark = {}, None
+    snapshot = read_snapshot(path)
+    # a snapshot of another rollup (or none) can't be patched, only answered again in full
+    fresh = watermark is not None and snapshot.get("watermark") == watermark
+
+    new = load_local_views(after=watermark or 0)
+    if fresh and new.height == 0:
+        return snapshot
+    df = append_rollup(new, rollup_path, meta=meta, source=SOURCE)
+
+    answers = snapshot["questions"] if fresh else {}
+    results = run_questions(df, scope="group", names=GROUP_QUESTIONS, until=None)
+    answers.update({name: X.to_dicts() for name, X in results.items()})
+
+    affected = new.get_column("user").unique().to_list() if fresh else None
+    if affected is not None:
+        df = df.filter(pl.col("user").cast(pl.Utf8).is_in(affected))
+    for name, X in run_questions(df, scope="user", names=USER_QUESTIONS, until=None).items():
+        kept = [row for row in answers.get(name, []) if affected is not None and row["user"] not in affected]
+        answers[name] = sorted(kept + X.to_dicts(), key=lambda row: (row["user"] or "", row["duration_hours"]))
+
+    meta = rollup_meta(rollup_path)
+    snapshot = {
+        "updated_at": dt.datetime.now().isoformat(timespec="seconds"),
+        "watermark": meta["watermark"],
+        "views": meta["views"],
+        "questions": answers,
+    }
+    # a dashboard reading it never sees half a snapshot
+    atomic_write_text(path, json.dumps(snapshot, indent=2, default=str))
+    return snapshot
+
+
+def read_snapshot(path=LIVE) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+from plexlib import data
+from plexlib.sketch import read_sketches
+from plexlib.synthetic import write_plex_dbs
+
+
+def streams_per_source():
+    conn = sqlite3.connect("combined.db")
+    try:
+        return dict(conn.execute('SELECT sourcedb, count(*) FROM "Stream" GROUP BY sourcedb'))
+    finally:
+        conn.close()
+
+
+def test_failed_source_is_extracted_again_without_the_others(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_plex_dbs(tmp_path, servers=2, shows=10, films=20, views=500, accounts=4)
+    sketch_views = data.sketch_views
+
+    def fail_on_server1(source_db, *args, **kwargs):
+        # once its streams are loaded
+        if source_db.stem == "server1":
+            raise RuntimeError("extract failed")
+        return sketch_views(source_db, *args, **kwargs)
+
+    monkeypatch.setattr(data, "sketch_views", fail_on_server1)
+    with pytest.raises(RuntimeError, match="extract failed"):
+        data.build_database(rebuild=True)
+    loaded = streams_per_source()
+    sketches = read_sketches("server0")
+
+    assert list(loaded) == ["server0"]
+    assert list(data.read_manifest()) == ["server0"]
+
+    monkeypatch.setattr(data, "sketch_views", sketch_views)
+    data.build_database(rebuild=True)
+
+    assert streams_per_source()["server0"] == loaded["server0"]
+    assert list(data.read_manifest()) == ["server0", "server1"]
+    assert {name: s.to_dict() for name, s in read_sketches("server0").items()} == {
+        name: s.to_dict() for name, s in sketches.items()
+    }
@@ -0,0 +1,25 @@
+from plexlib.dedup import DisjointSet, cluster_names
+
+
+def test_refused_pair_stays_apart_through_other_items():
+    clusters = DisjointSet("abc")
+    assert clusters.refuse("a", "c")
+    clusters.union("a", "b")
+
+    assert clusters.union("b", "c") is None
+    assert sorted(map(sorted, clusters.groups())) == [["a", "b"], ["c"]]
+
+
+def test_refuse_within_a_cluster_fails():
+    clusters = DisjointSet("ab")
+    clusters.union("a", "b")
+
+    assert not clusters.refuse("a", "b")
+
+
+def test_identical_names_respect_refusals():
+    clusters = DisjointSet([1, 2, 3])
+    clusters.refuse(1, 2)
+    groups = cluster_names([(1, "user4"), (2, "user4"), (3, "someone else")], 95, clusters=clusters, new=set())
+
+    assert not any({1, 2} <= set(group) for group in groups)
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from plexlib.data import check_views_read, fetch_frames_from_db
+from plexlib.synthetic import SCHEMA
+
+
+def source_db(path, viewed_at):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany(
+        "INSERT INTO metadata_item_views (id, guid, viewed_at) VALUES (?, 'plex://1', ?)",
+        list(enumerate(viewed_at, 1)),
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_watermark_moves_past_every_view_read(tmp_path):
+    # one view each from last year, the stats' year and one still being watched
+    db = source_db(tmp_path / "server0.db", [1672000000, 1690000000, 1790000000])
+
+    check_views_read(db, 3, 0, 3)
+    check_views_read(db, 1, 2, 3)
+
+
+def test_views_left_out_stop_the_watermark(tmp_path):
+    db = source_db(tmp_path / "server0.db", [1672000000, 1690000000, 1790000000])
+
+    with pytest.raises(RuntimeError, match="1 of the 3 views"):
+        check_views_read(db, 1, 0, 3)
+
+
+def test_frames_keep_their_own_sourcedb(tmp_path):
+    db = source_db(tmp_path / "server0.db", [1672000000, 1690000000, 1790000000])
+
+    (frame,) = fetch_frames_from_db(db, "SELECT id FROM metadata_item_views")
+    assert frame.get_column("sourcedb").to_list() == ["server0"] * 3
+    (frame,) = fetch_frames_from_db(db, "SELECT id, 'combined' AS sourcedb FROM metadata_item_views")
+    assert frame.get_column("sourcedb").to_list() == ["combined"] * 3
+
+
+def test_frames_of_no_rows_have_the_columns(tmp_path):
+    db = source_db(tmp_path / "server0.db", [])
+
+    (frame,) = fetch_frames_from_db(db, "SELECT id, viewed_at FROM metadata_item_views")
+    assert frame.height == 0
+    assert frame.columns == ["id", "viewed_at", "sourcedb"]
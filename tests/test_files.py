@@ -0,0 +1,40 @@
+import pytest
+
+from plexlib.files import atomic_write, swap_directory
+
+
+def fail(*args):
+    raise RuntimeError("write failed")
+
+
+def test_failed_swap_keeps_the_old_directory(tmp_path):
+    path = tmp_path / "rollup"
+    swap_directory(path, lambda tmp: (tmp / "rollup.json").write_text("old"))
+
+    with pytest.raises(RuntimeError):
+        swap_directory(path, fail)
+
+    assert (path / "rollup.json").read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["rollup"]
+
+
+def test_swap_past_an_interrupted_one(tmp_path):
+    path = tmp_path / "rollup"
+    swap_directory(path, lambda tmp: (tmp / "rollup.json").write_text("old"))
+    (tmp_path / ".rollup.old" / "stale").mkdir(parents=True)
+
+    swap_directory(path, lambda tmp: (tmp / "rollup.json").write_text("new"))
+
+    assert (path / "rollup.json").read_text() == "new"
+    assert [p.name for p in tmp_path.iterdir()] == ["rollup"]
+
+
+def test_failed_write_leaves_no_temp_file(tmp_path):
+    path = tmp_path / "live.json"
+    path.write_text("old")
+
+    with pytest.raises(RuntimeError):
+        atomic_write(path, fail)
+
+    assert path.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["live.json"]
@@ -0,0 +1,39 @@
+import datetime as dt
+import json
+
+import polars as pl
+
+from plexlib.reports import META, write_reports
+
+
+def views(users):
+    n = len(users)
+    return pl.DataFrame(
+        {
+            "user": users,
+            "viewed_at": [dt.datetime(2023, 6, 1, 20)] * n,
+            "media_type": ["Movie"] * n,
+            "title": ["Movie"] * n,
+            "grandparent_title": [None] * n,
+            "duration_minutes": [90] * n,
+            "rating": [7.5] * n,
+            "tags_genre": ["Drama"] * n,
+            "tags_star": ["Someone"] * n,
+            "tags_director": ["Someone Else"] * n,
+            "tags_country": ["Canada"] * n,
+        },
+        schema_overrides={"grandparent_title": pl.Utf8},
+    )
+
+
+def test_users_named_like_the_meta_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "reports"
+    users = ["reports", ".reports", "alice"]
+
+    assert write_reports(views(users), path=path) == sorted(users)
+
+    assert json.loads((path / "reports.json").read_text())["user"] == "reports"
+    assert json.loads((path / "%2Ereports.json").read_text())["user"] == ".reports"
+    assert sorted(json.loads((path / META).read_text())["users"]) == sorted(users)
+    assert write_reports(views(users), path=path) == []
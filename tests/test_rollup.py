@@ -0,0 +1,51 @@
+import datetime as dt
+
+import polars as pl
+
+from plexlib.compact import compact
+from plexlib.rollup import append_rollup, rollup_meta, sync_rollup
+
+
+def views(stream_ids, media_ids, user="alice"):
+    n = len(stream_ids)
+    return compact(
+        pl.DataFrame(
+            {
+                "stream_id": stream_ids,
+                "user": [user] * n,
+                "viewed_at": [dt.datetime(2023, 6, 1, 20)] * n,
+                "media_id": media_ids,
+                "media_type": ["Movie"] * n,
+                "title": [f"Movie {i}" for i in media_ids],
+                "grandparent_title": [None] * n,
+                "rating": [7.5] * n,
+                "tags_genre": ["Drama"] * n,
+                "tags_star": [None] * n,
+                "tags_director": [None] * n,
+                "tags_country": [None] * n,
+                "duration_minutes": [90] * n,
+            }
+        )
+    )
+
+
+def test_append_across_id_widths(tmp_path):
+    # the first load's ids need 32 bits, the next one's would fit in 8
+    path = tmp_path / "rollup"
+    append_rollup(views([1, 2], [40000, 50000]), path, meta={})
+    base = append_rollup(views([3], [5]), path).collect()
+
+    assert base.sort("media_id").get_column("media_id").to_list() == [5, 40000, 50000]
+    assert base.get_column("views").sum() == 3
+    assert rollup_meta(path)["watermark"] == 3
+
+
+def test_relabeled_views_are_rolled_up_again(tmp_path):
+    # a build linking alice's account into bob's keeps the streams, under bob's name
+    path = tmp_path / "rollup"
+    sync_rollup(views([1, 2], [5, 6]), path, source="combined.db")
+    base = sync_rollup(views([1, 2, 3], [5, 6, 7], user="bob"), path, source="combined.db").collect()
+
+    assert base.get_column("user").cast(pl.Utf8).unique().to_list() == ["bob"]
+    assert base.get_column("views").sum() == 3
+    assert rollup_meta(path)["views"] == 3
@@ -0,0 +1,54 @@
+import datetime as dt
+
+import polars as pl
+
+from plexlib.sessions import sessionize, session_table
+
+
+def at(hhmm):
+    return dt.datetime.combine(dt.date(2023, 6, 1), dt.time.fromisoformat(hhmm))
+
+
+def views(*spans):
+    """One view per `(user, start, end)`, with times as `HH:MM` on the same day."""
+    rows = [
+        {
+            "stream_id": i,
+            "user": user,
+            "viewed_at": at(end),
+            "device_name": f"device {i}",
+            "media_type": "Movie",
+            "title": f"Title {i}",
+            "grandparent_title": None,
+            "duration_minutes": int((at(end) - at(start)).total_seconds() // 60),
+        }
+        for i, (user, start, end) in enumerate(spans, 1)
+    ]
+    return pl.DataFrame(rows)
+
+
+def test_view_nested_in_a_longer_one():
+    # an episode watched while a movie from before it was still playing, and ends after it
+    sessionized = sessionize(views(("alice", "09:30", "11:30"), ("alice", "10:00", "10:30"))).collect()
+
+    assert sessionized.sort("stream_id").get_column("overlap_minutes").to_list() == [0, 30]
+    assert sessionized.get_column("counted_minutes").sum() == 120
+    assert session_table(sessionized).collect().get_column("counted_minutes").to_list() == [120]
+
+
+def test_overlaps_stay_within_a_user():
+    sessionized = sessionize(views(("alice", "09:30", "11:30"), ("bob", "10:00", "10:30"))).collect()
+
+    assert sessionized.get_column("overlap_minutes").to_list() == [0, 0]
+    assert sessionized.get_column("session_id").n_unique() == 2
+
+
+def test_view_without_a_duration_stays_within_its_user():
+    # bob's view ended after alice's started, with no duration it can't be sorted before hers
+    spans = views(("alice", "11:30", "12:00"), ("bob", "11:40", "11:45"), ("alice", "12:20", "12:30"))
+    spans = spans.with_columns(pl.when(pl.col("user") != "bob").then(pl.col("duration_minutes")))
+    sessionized = sessionize(spans).collect().sort("stream_id")
+
+    assert sessionized.get_column("overlap_minutes").to_list() == [0, 0, 0]
+    assert sessionized.get_column("duration_minutes").to_list() == [30, 0, 10]
+    assert sessionized.get_column("session_id").n_unique() == 2
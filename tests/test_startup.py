@@ -0,0 +1,9 @@
+from bench import HEAVY_MODULES, STARTUP_BUDGET, heavy_imports, startup_seconds
+
+
+def test_help_starts_within_budget():
+    assert startup_seconds("--help") <= STARTUP_BUDGET
+
+
+def test_importing_main_skips_heavy_backends():
+    assert heavy_imports() == [], f"main.py must not import any of {HEAVY_MODULES} up front"